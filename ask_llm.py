@@ -1,96 +1,110 @@
 import argparse
-import pickle
-import ast
-from llm.chatgpt import init_chatgpt, ask_llm
+from llm.chatgpt import init_chatgpt, ask_llm, client
+from llm.rate_limit import RateLimiter, queue_key
 from utils.enums import LLM
-from utils.chat2sql import get_columns, get_unique_values
+from utils.chat2sql import get_columns, get_value_matches, get_relevant_values
+from utils.parsing import extract_sql, parse_names
+from utils.pipeline import Pipeline, add_run_arguments, init_run, load_jobs, index_tables, join_hint, prefilter_tables
 
 
-def parse_args():
+def parse_args(argv=None):
     """Parse and return command-line arguments."""
     parser = argparse.ArgumentParser()
-    parser.add_argument("--question_folder", type=str,  default = './dataset/')
-    parser.add_argument("--question_file", type=str,  default = 'fuzzy_queries_1.pkl')
     parser.add_argument("--openai_api_key", type=str)
     parser.add_argument("--model", type=str, choices=[LLM.TEXT_DAVINCI_003, LLM.GPT_35_TURBO, 
                                                       LLM.GPT_35_TURBO_0613, LLM.GPT_35_TURBO_16K, 
                                                       LLM.GPT_4], default=LLM.GPT_35_TURBO)
-    parser.add_argument("--start_index", type=int, default=0)
-    parser.add_argument("--end_index", type=int, default=1000000)
-    parser.add_argument("--temperature", type=float, default=0)
-    parser.add_argument("--mini_index_path", type=str, default="")
-    parser.add_argument("--batch_size", type=int, default=1)
-    parser.add_argument("--n", type=int, default=1, help="Size of self-consistent set")
-    parser.add_argument("--output_folder", type=str, default=r'./dataset/')
-    return parser.parse_args()
+    parser.add_argument("--rpm", type=int, default=None, help="Requests per minute allowed by the provider")
+    parser.add_argument("--tpm", type=int, default=None, help="Tokens per minute allowed by the provider")
+    add_run_arguments(parser)
+    return parser.parse_args(argv)
 
-def load_tables():
-    """Load valid tables from pickle file."""
-    with open("./dataset/valid_tables.pkl", 'rb') as file:
-        return pickle.load(file)
-
-def generate_prompt(question, db, related_tables=None, columns=None, related_columns = None):
+def generate_prompt(question, db, related_tables=None, columns=None, related_columns = None, joins=None):
     """Generate a prompt for querying the LLM."""
     if related_tables:
         return f"User's query is : {question}. Based on user's query, identify the related tables from {db}. Only return the tables' names, do not reply any other texts. Reply tables' names as a list. For example, a possible output maybe ['college','expert']"
     elif columns:
         return f"User's query is : {question}. Based on user's query, identify the related columns {columns}. Only return the columns' name, do not reply any other texts. Reply columns' name as a list, For example, a possible output maybe ['college','expert']"
-    return f"User's query is : {question}. Based on user's query, generate the proper SQL. The following dictionary contains all related tables, columns and their unique values. {related_columns} Only return the SQL, do not reply any other texts."
+    return f"User's query is : {question}. Based on user's query, generate the proper SQL. The following lines list all related tables as table(column: unique values).\n{related_columns}\n{join_hint(joins)}Only return the SQL, do not reply any other texts."
+
+def ask(args, prompt, until=None):
+    """Replies of the LLM to one prompt, one per sample of the self-consistent set."""
+    response = ask_llm(args.model, [prompt], args.temperature, args.n, until)['response'][0]
+    return response if isinstance(response, list) else [response]
+
+pipeline = Pipeline(ask, generate_prompt, extension=".pkl")
+answer_question = pipeline.answer_question
+answer_fused = pipeline.answer_fused
+get_output_path = pipeline.get_output_path
+
+def ask_batched(args, prompts, database):
+    """Ask the LLM for every prompt, sending up to batch_size prompts per request, and return one response per prompt.
 
-def get_related_tables(question, args, db, tables):
-    """Get related tables from LLM."""
-    prompt = generate_prompt(question, db, related_tables=True)
-    batch = [prompt]
-    res = ask_llm(args.model, batch, args.temperature, args.n)
-    related_tables = ast.literal_eval(res['response'][0])
-    return related_tables
+    The prompts of a failed request get None, so their questions are skipped and retried by the next run.
+    """
+    responses = []
+    # the batches of a database are sent one after the other, the databases already run in parallel
+    for i in range(0, len(prompts), args.batch_size):
+        batch = prompts[i:i + args.batch_size]
+        try:
+            responses.extend(ask_llm(args.model, batch, args.temperature, args.n)['response'])
+        except Exception as e:
+            print(f"Error occurs when executing on {database}: {type(e).__name__}: {e}")
+            responses.extend([None] * len(batch))
+    return responses
 
-def get_related_columns(question, args, database, related_tables):
-    """Get related columns for each table."""
-    related_columns_dic = {}
-    for table in related_tables:
-        columns = get_columns(database, table)
-        prompt = generate_prompt(question, database, columns=columns)
-        batch = [prompt]
-        res = ask_llm(args.model, batch, args.temperature, args.n)
-        related_columns = ast.literal_eval(res['response'][0])
-        columns_value = {col: get_unique_values(database, table, col) for col in related_columns}
-        related_columns_dic[table] = columns_value
-    return related_columns_dic
+def answer_database(questions, args, database, db):
+    """Run the three steps for all questions of a database, batching the prompts of each step across questions.
 
-def generate_sql(question, args, related_columns_dic,database):
-    """Generate the SQL query from LLM."""
-    prompt = generate_prompt(question, database, related_columns = related_columns_dic)
-    batch = [prompt]
-    res = ask_llm(args.model, batch, args.temperature, args.n)
-    return res['response']
+    Returns the answer of every question, None for the questions whose requests failed.
+    """
+    queue_key.set(database)
+    failed = set()
+    # Step 1: Get related tables
+    related_tables = [prefilter_tables(question, args, database, db) for question in questions]
+    unresolved = [i for i, tables in enumerate(related_tables) if tables is None]
+    prompts = [generate_prompt(questions[i], db, related_tables=True) for i in unresolved]
+    for i, res in zip(unresolved, ask_batched(args, prompts, database)):
+        if res is None:
+            failed.add(i)
+        else:
+            related_tables[i] = parse_names(res, db) or index_tables(questions[i], args, database, db)
+    # Step 2: Get related columns
+    pairs = [(i, table) for i, tables in enumerate(related_tables) if i not in failed for table in tables]
+    # the columns of a table and the values a question mentions are looked up once
+    columns = {table: get_columns(database, table) for table in dict.fromkeys(table for _, table in pairs)}
+    matches = {i: get_value_matches(database, questions[i]) for i in dict.fromkeys(i for i, _ in pairs)}
+    prompts = [generate_prompt(questions[i], database, columns=columns[table]) for i, table in pairs]
+    related_columns_dics = [{} for _ in questions]
+    for (i, table), res in zip(pairs, ask_batched(args, prompts, database)):
+        if res is None:
+            failed.add(i)
+            continue
+        related_columns = parse_names(res, columns[table]) or columns[table]
+        related_columns_dics[i][table] = {col: get_relevant_values(database, table, col, matches[i]) for col in related_columns}
+    # Step 3: Generate SQL
+    answered = [i for i in range(len(questions)) if i not in failed]
+    prompts = [pipeline.sql_prompt(questions[i], args, related_columns_dics[i], database) for i in answered]
+    sqls = [None] * len(questions)
+    for i, sql in zip(answered, ask_batched(args, prompts, database)):
+        if sql is not None:
+            sqls[i] = [extract_sql(sql)]
+    return sqls
+
+def setup(args):
+    """Initialize the LLM client, caches and indexes a run uses, and return the valid tables."""
+    init_chatgpt(args.openai_api_key)
+    if args.rpm or args.tpm:
+        client.rate_limiter = RateLimiter(args.rpm, args.tpm)
+    return init_run(args)
 
 def main():
-    result= {}
     args = parse_args()
     assert args.model in LLM.BATCH_FORWARD or (args.model not in LLM.BATCH_FORWARD and args.batch_size == 1), \
         f"{args.model} doesn't support batch_size > 1"
-
-    #  question = 'Select all the colleges in Texas.'
-    init_chatgpt(args.openai_api_key)
-    with open(args.question_folder + args.question_file, 'rb') as file:
-        question_file = pickle.load(file)
-    tables = load_tables()
-    for database in question_file.keys():
-        db = tables[database]
-        questions = question_file[database]
-        questions = questions[0].split('\n')
-        result[database] = {}
-        for  question in questions:
-            # Step 1: Get related tables
-            related_tables = get_related_tables(question, args, db, tables)
-            # Step 2: Get related columns
-            related_columns_dic = get_related_columns(question, args, database, related_tables)
-            # Step 3: Generate SQL
-            sql = generate_sql(question, args, related_columns_dic,db)
-            result[database][question] = sql
-    with open(args.output_folder + 'output_' + args.model + '_' + args.question_file + '.pkl', 'wb') as file:
-        pickle.dump(result, file)
+    tables = setup(args)
+    jobs = load_jobs(args, tables)
+    pipeline.run(args, tables, jobs, answer_database if args.batch_size > 1 else None)
 
 if __name__ == '__main__':
     main()
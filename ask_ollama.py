@@ -1,94 +1,41 @@
 import argparse
-import pickle
-import ast
-from utils.enums import LLM
-from utils.chat2sql import get_columns, get_unique_values, res_to_list
+from utils.pipeline import Pipeline, add_run_arguments, init_run, load_jobs, join_hint
 from llm.ollama import ask_llm
 
 
-def parse_args():
+def parse_args(argv=None):
     """Parse and return command-line arguments."""
     parser = argparse.ArgumentParser()
-    parser.add_argument("--question_folder", type=str,  default = './dataset/')
-    parser.add_argument("--question_file", type=str,  default = 'fuzzy_queries_1.pkl')
     parser.add_argument("--model", type=str, choices=['wizardlm2:7b','llama2:13b','openchat:7b','smollm:1.7b','codellama:7b','sqlcoder:7b','deepseek-coder-v2:16b','phi'], default='openchat:7b')
-    parser.add_argument("--start_index", type=int, default=0)
-    parser.add_argument("--end_index", type=int, default=1000000)
-    parser.add_argument("--temperature", type=float, default=0)
-    parser.add_argument("--mini_index_path", type=str, default="")
-    parser.add_argument("--batch_size", type=int, default=1)
-    parser.add_argument("--n", type=int, default=1, help="Size of self-consistent set")
-    parser.add_argument("--output_folder", type=str, default=r'./dataset/')
-    return parser.parse_args()
+    add_run_arguments(parser)
+    return parser.parse_args(argv)
 
-def load_tables():
-    """Load valid tables from pickle file."""
-    with open("./dataset/valid_tables.pkl", 'rb') as file:
-        return pickle.load(file)
-
-def generate_prompt(question, db, related_tables=None, columns=None, related_columns = None):
+def generate_prompt(question, db, related_tables=None, columns=None, related_columns = None, joins=None):
     """Generate a prompt for querying the LLM."""
     if related_tables:
         return f"User's query is : {question} Based on user's query, identify the related tables from {db}. Reply tables' names as a list. Only return the tables' names, do not reply any other texts. For example, a possible output format maybe ['table1','table2']"
     elif columns:
         return f"User's query is : {question} Based on user's query, identify the related columns {columns}. Reply columns' name as a list. Only return the columns' name, do not reply any other texts. For example, a possible output format maybe ['column1','column2']"
-    return f"User's query is : {question} Based on user's query, generate the proper SQL. The following dictionary contains all related tables, columns and their unique values. {related_columns} Only return the SQL, do not reply any other texts."
+    return f"User's query is : {question} Based on user's query, generate the proper SQL. The following lines list all related tables as table(column: unique values).\n{related_columns}\n{join_hint(joins)}Only return the SQL, do not reply any other texts."
 
-def get_related_tables(question, args, db, tables):
-    """Get related tables from LLM."""
-    prompt = generate_prompt(question, db, related_tables=True)
-    res = ask_llm(args.model, prompt, args.temperature, args.n)
-    related_tables = res_to_list(res['response'])
-    return related_tables
+def ask(args, prompt, until=None):
+    """Reply of the LLM to one prompt, the completion endpoint generates a single one."""
+    return [ask_llm(args.model, prompt, args.temperature, args.n, until)['response']]
 
-def get_related_columns(question, args, database, related_tables):
-    """Get related columns for each table."""
-    related_columns_dic = {}
-    for table in related_tables:
-        columns = get_columns(database, table)
-        prompt = generate_prompt(question, database, columns=columns)
-        res = ask_llm(args.model, prompt, args.temperature, args.n)
-        related_columns = res_to_list(res['response'])
-        columns_value = {col: get_unique_values(database, table, col) for col in related_columns}
-        related_columns_dic[table] = columns_value
-    return related_columns_dic
+pipeline = Pipeline(ask, generate_prompt, keep_all=False)
+answer_question = pipeline.answer_question
+answer_fused = pipeline.answer_fused
+get_output_path = pipeline.get_output_path
 
-def generate_sql(question, args, related_columns_dic,database):
-    """Generate the SQL query from LLM."""
-    prompt = generate_prompt(question, database, related_columns = related_columns_dic)
-    res = ask_llm(args.model, prompt, args.temperature, args.n)
-    return res['response']
+def setup(args):
+    """Initialize the caches and indexes a run uses, and return the valid tables."""
+    return init_run(args)
 
 def main():
-    result= {}
     args = parse_args()
-
-    with open(args.question_folder + args.question_file, 'rb') as file:
-        question_file = pickle.load(file)
-    tables = load_tables()
-    for database in question_file.keys():
-        db = tables[database]
-        questions = question_file[database]
-        questions = questions[0].split('\n')
-        result[database] = {}
-        for  question in questions:
-            # Step 1: Get related tables
-            try:
-                related_tables = get_related_tables(question, args, db, tables)
-                # if not set(related_tables).issubset(set(db)):
-                #     # print(database)
-                #     continue
-                # Step 2: Get related columns
-                related_columns_dic = get_related_columns(question, args, database, related_tables)
-                # Step 3: Generate SQL
-                sql = generate_sql(question, args, related_columns_dic,db)
-                result[database][question] = sql
-            except:
-                print(f"Error occurs when executing on {database}")
-                continue
-    
-    with open(args.output_folder + 'output_' + args.model.replace(':','-') + '_' + args.question_file, 'wb') as file:
-        pickle.dump(result, file)
+    tables = setup(args)
+    jobs = load_jobs(args, tables)
+    pipeline.run(args, tables, jobs)
 
 if __name__ == '__main__':
     main()
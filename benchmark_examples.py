@@ -0,0 +1,85 @@
+import argparse
+import os
+import random
+import time
+
+import numpy as np
+
+from benchmark_normalization import TABLES, synthesize_query
+from utils.enums import SELECTOR_TYPE
+from utils.examples import ExampleSelector, load_examples, mask_question, schema_words
+from utils.utils import jaccard_similarity, sql2skeleton
+
+
+def synthesize_examples(n_examples):
+    """Examples over the tables of benchmark_normalization.py, with their queries standing in for questions."""
+    schema = {
+        "db_id": "synthetic",
+        "table_names_original": list(TABLES),
+        "table_names": [table.lower() for table in TABLES],
+        "column_names_original": [[i, column] for i, table in enumerate(TABLES) for column in TABLES[table]],
+        "column_names": [[i, column.lower()] for i, table in enumerate(TABLES) for column in TABLES[table]]
+    }
+    examples = []
+    while len(examples) < n_examples:
+        query = synthesize_query()
+        try:
+            skeleton = sql2skeleton(query, schema)
+        except Exception:
+            continue
+        examples.append({"db_id": f"db{len(examples) % 20}", "question": query, "query": query, "skeleton": skeleton,
+                         "masked_question": mask_question(query, schema_words(schema))})
+    return examples, schema
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the vectorized skeleton similarity against jaccard_similarity and time example selection.")
+    parser.add_argument("--train_path", type=str, nargs="+", default=[r'./dataset/spider/train_spider.json'])
+    parser.add_argument("--tables_path", type=str, default=r'./dataset/spider/tables.json')
+    parser.add_argument("--examples_path", type=str, default=r'./dataset/spider_examples.pkl', help="Cache of the examples and their skeletons")
+    parser.add_argument("--n_examples", type=int, default=7000, help="Examples synthesized when the Spider files are missing")
+    parser.add_argument("--n_queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    if all(os.path.exists(path) for path in args.train_path + [args.tables_path]):
+        examples = load_examples(args.train_path, args.tables_path, args.examples_path)
+        schema = None
+    else:
+        examples, schema = synthesize_examples(args.n_examples)
+    queries = random.sample(range(len(examples)), min(args.n_queries, len(examples)))
+    selector = ExampleSelector(examples, SELECTOR_TYPE.EUC_DISTANCE_PRE_SKELETON_SIMILARITY_THRESHOLD)
+    index = selector.skeletons
+
+    start = time.perf_counter()
+    expected = [[jaccard_similarity(examples[i]["skeleton"], example["skeleton"]) for example in examples]
+                for i in queries[0:20]]
+    loop_time = (time.perf_counter() - start) / len(expected)
+    error = max(float(np.max(np.abs(index.jaccard(examples[i]["skeleton"]) - scores)))
+                for i, scores in zip(queries, expected))
+
+    start = time.perf_counter()
+    for i in queries:
+        index.top_k(examples[i]["skeleton"], args.k)
+    top_k_time = (time.perf_counter() - start) / len(queries)
+    start = time.perf_counter()
+    for i in queries:
+        selector.question_scores(examples[i]["question"])
+    question_time = (time.perf_counter() - start) / len(queries)
+
+    print(f"{len(examples)} examples, {len(index.vocabulary)} skeleton tokens, max difference to jaccard_similarity {error:.2e}")
+    print(f"jaccard_similarity loop: {loop_time * 1000:.3f} ms/query")
+    print(f"skeleton top-{args.k}:      {top_k_time * 1000:.3f} ms/query ({loop_time / top_k_time:.0f}x)")
+    print(f"question similarity:     {question_time * 1000:.3f} ms/query")
+    if schema is not None:
+        i = queries[0]
+        selected = selector.select(examples[i]["question"], args.k, schema, examples[i]["query"], examples[i]["db_id"])
+        print(f"selected for {examples[i]['query']!r}:")
+        for j in selected:
+            print(f"  {examples[j]['query']!r}")
+
+
+if __name__ == '__main__':
+    main()
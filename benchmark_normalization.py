@@ -0,0 +1,289 @@
+import argparse
+import json
+import os
+import random
+import re
+import time
+
+from sql_metadata import Parser
+
+from utils.sql_lexer import FAST_PATH, token_values
+from utils.utils import sql_normalization
+
+TABLES = {
+    "singer": ["singer_id", "name", "country", "age", "song_name", "is_male"],
+    "concert": ["concert_id", "concert_name", "theme", "stadium_id", "year"],
+    "stadium": ["stadium_id", "location", "name", "capacity", "highest", "average"],
+    "singer_in_concert": ["concert_id", "singer_id"],
+    "college": ["cName", "state", "enr"],
+    "Player": ["pID", "pName", "yCard", "HS"],
+    "Tryout": ["pID", "cName", "pPos", "decision"],
+    "Faculty_Participates_in": ["FacID", "actid"],
+    "Activity": ["actid", "activity_name"],
+    "Student": ["StuID", "LName", "Fname", "Age", "Sex", "Major", "Advisor", "city_code"],
+}
+STRINGS = ["'TX'", "'France'", '"Bob"', "'O''Neil'", "'%a%'", "'New York'", "'Accepted'", "'2009-05-01'", "'It''s'"]
+NUMBERS = ["10", "1", "-3", "2.5", "1000", "0"]
+
+
+def reference_normalization(sql):
+    """`utils.utils.sql_normalization` before the lexer, kept verbatim to check the output is unchanged."""
+    sql = sql.strip()
+    def white_space_fix(s):
+        parsed_s = Parser(s)
+        s = " ".join([token.value for token in parsed_s.tokens])
+
+        return s
+
+    # convert everything except text between single quotation marks to lower case
+    def lower(s):
+        in_quotation = False
+        out_s = ""
+        for char in s:
+            if in_quotation:
+                out_s += char
+            else:
+                out_s += char.lower()
+
+            if char == "'":
+                if in_quotation:
+                    in_quotation = False
+                else:
+                    in_quotation = True
+
+        return out_s
+
+    # remove ";"
+    def remove_semicolon(s):
+        if s.endswith(";"):
+            s = s[:-1]
+        return s
+
+    # double quotation -> single quotation
+    def double2single(s):
+        return s.replace("\"", "'")
+
+    def add_asc(s):
+        pattern = re.compile(r'order by (?:\w+ \( \S+ \)|\w+\.\w+|\w+)(?: (?:\+|\-|\<|\<\=|\>|\>\=) (?:\w+ \( \S+ \)|\w+\.\w+|\w+))*')
+        if "order by" in s and "asc" not in s and "desc" not in s:
+            for p_str in pattern.findall(s):
+                s = s.replace(p_str, p_str + " asc")
+
+        return s
+
+    def sql_split(s):
+        while "  " in s:
+            s = s.replace("  ", " ")
+        s = s.strip()
+        i = 0
+        toks = []
+        while i < len(s):
+            tok = ""
+            if s[i] == "'":
+                tok = tok + s[i]
+                i += 1
+                while i < len(s) and s[i] != "'":
+                    tok = tok + s[i]
+                    i += 1
+                if i < len(s):
+                    tok = tok + s[i]
+                    i += 1
+            else:
+                while i < len(s) and s[i] != " ":
+                    tok = tok + s[i]
+                    i += 1
+                while i < len(s) and s[i] == " ":
+                    i += 1
+            toks.append(tok)
+        return toks
+
+    def remove_table_alias(s):
+        tables_aliases = Parser(s).tables_aliases
+        new_tables_aliases = {}
+        for i in range(1, 11):
+            if "t{}".format(i) in tables_aliases.keys():
+                new_tables_aliases["t{}".format(i)] = tables_aliases["t{}".format(i)]
+        table_names = []
+        for tok in sql_split(s):
+            if '.' in tok:
+                table_names.append(tok.split('.')[0])
+        for table_name in table_names:
+            if table_name in tables_aliases.keys():
+                new_tables_aliases[table_name] = tables_aliases[table_name]
+        tables_aliases = new_tables_aliases
+
+        new_s = []
+        pre_tok = ""
+        for tok in sql_split(s):
+            if tok in tables_aliases.keys():
+                if pre_tok == 'as':
+                    new_s = new_s[:-1]
+                elif pre_tok != tables_aliases[tok]:
+                    new_s.append(tables_aliases[tok])
+            elif '.' in tok:
+                split_toks = tok.split('.')
+                for i in range(len(split_toks)):
+                    if len(split_toks[i]) > 2 and split_toks[i][0] == "'" and split_toks[i][-1] == "'":
+                        split_toks[i] = split_toks[i].replace("'", "")
+                        split_toks[i] = split_toks[i].lower()
+                    if split_toks[i] in tables_aliases.keys():
+                        split_toks[i] = tables_aliases[split_toks[i]]
+                new_s.append('.'.join(split_toks))
+            else:
+                new_s.append(tok)
+            pre_tok = tok
+
+        # remove as
+        s = new_s
+        new_s = []
+        for i in range(len(s)):
+            if s[i] == "as":
+                continue
+            if i > 0 and s[i-1] == "as":
+                continue
+            new_s.append(s[i])
+        new_s = ' '.join(new_s)
+
+        # for k, v in tables_aliases.items():
+        #     s = s.replace("as " + k + " ", "")
+        #     s = s.replace(k, v)
+
+        return new_s
+
+    processing_func = lambda x: remove_table_alias(add_asc(lower(white_space_fix(double2single(remove_semicolon(x))))))
+
+    return processing_func(sql.strip())
+
+
+def random_case(word):
+    return random.choice([word.upper(), word.lower(), word.capitalize()])
+
+
+def synthesize_query(depth=0):
+    """A random query in the style of Spider's gold SQL, with random keyword case, spacing and quoting."""
+    kw = random_case
+    tables = random.sample(list(TABLES), random.choice([1, 1, 2, 2, 3]))
+    aliased = len(tables) > 1 and random.random() < 0.8 or random.random() < 0.2
+    names = [f"T{i + 1}" if aliased else table for i, table in enumerate(tables)]
+    prefix = aliased or len(tables) > 1
+
+    def column(i=None):
+        i = random.randrange(len(tables)) if i is None else i
+        name = random.choice(TABLES[tables[i]])
+        if random.random() < 0.05:
+            name = f"`{name}`"
+        return f"{names[i]}.{name}" if prefix else name
+
+    selected = []
+    for _ in range(random.choice([1, 1, 2, 3])):
+        r = random.random()
+        if r < 0.15:
+            selected.append(f"{kw('count')}(*)")
+        elif r < 0.3:
+            selected.append(f"{kw(random.choice(['avg', 'max', 'min', 'sum']))}({column()})")
+        elif r < 0.35:
+            selected.append("*" if not prefix else f"{names[0]}.*")
+        elif r < 0.4:
+            selected.append(f"{kw('count')}({kw('distinct')} {column()})")
+        else:
+            selected.append(column())
+    sql = f"{kw('select')} {kw('distinct') + ' ' if random.random() < 0.1 else ''}{' , '.join(selected)} {kw('from')} "
+    if len(tables) > 1 and random.random() < 0.15:
+        sql += " , ".join(f"{table} {kw('as')} {name}" if aliased else table for table, name in zip(tables, names))
+    else:
+        sql += f"{tables[0]} {kw('as') + ' ' if random.random() < 0.9 else ''}{names[0]}" if aliased else tables[0]
+        for i in range(1, len(tables)):
+            sql += f" {kw('join')} {tables[i]} {kw('as') + ' ' if random.random() < 0.9 else ''}{names[i]} " \
+                   f"{kw('on')} {column(i - 1)} = {column(i)}"
+
+    conditions = []
+    for _ in range(random.choice([0, 0, 1, 1, 2])):
+        r = random.random()
+        if r < 0.4:
+            conditions.append(f"{column()} {random.choice(['=', '!=', '>', '<', '>=', '<='])} {random.choice(STRINGS + NUMBERS)}")
+        elif r < 0.55:
+            conditions.append(f"{column()} {kw('like')} {random.choice(STRINGS)}")
+        elif r < 0.65:
+            conditions.append(f"{column()} {kw('between')} {random.choice(NUMBERS)} {kw('and')} {random.choice(NUMBERS)}")
+        elif r < 0.8 and depth < 2:
+            conditions.append(f"{column()} {kw(random.choice(['in', 'not in']))} ( {synthesize_query(depth + 1)} )")
+        elif depth < 2:
+            conditions.append(f"{column()} {random.choice(['=', '>', '<'])} ({synthesize_query(depth + 1)})")
+    if conditions:
+        sql += f" {kw('where')} " + f" {kw(random.choice(['and', 'or']))} ".join(conditions)
+    if random.random() < 0.25:
+        sql += f" {kw('group by')} {column()}"
+        if random.random() < 0.4:
+            sql += f" {kw('having')} {kw('count')}(*) {random.choice(['>', '>=', '='])} {random.choice(NUMBERS)}"
+    if random.random() < 0.3:
+        order = random.choice([column(), f"{kw('count')}(*)", f"{kw('avg')}({column()})", f"{column()} + {column()}"])
+        sql += f" {kw('order by')} {order}{random.choice(['', ' ' + kw('asc'), ' ' + kw('desc')])}"
+        if random.random() < 0.5:
+            sql += f" {kw('limit')} {random.choice(['1', '3', '10'])}"
+    if depth == 0 and random.random() < 0.1:
+        sql += f" {kw(random.choice(['union', 'intersect', 'except']))} {synthesize_query(depth + 1)}"
+    if depth == 0:
+        r = random.random()
+        if r < 0.1:
+            sql = sql.replace(" ", "  ")
+        elif r < 0.15:
+            sql = sql.replace(" ", "\n", 3)
+        elif r < 0.2:
+            sql += " ;"
+        elif r < 0.22:
+            sql = random.choice(["-- comment\n", "WITH x AS (SELECT 1) ", "(", "INSERT INTO t "]) + sql
+        elif r < 0.24:
+            sql += "; SELECT 1"
+    return sql
+
+
+def load_queries(args):
+    if os.path.exists(args.gold_path):
+        with open(args.gold_path) as file:
+            return [entry["query"] for entry in json.load(file)][0:args.n_queries]
+    random.seed(args.seed)
+    return [synthesize_query() for _ in range(args.n_queries)]
+
+
+def run(function, queries):
+    """Outputs (or the raised error) of function for every query, and the seconds it took."""
+    outputs = []
+    start = time.perf_counter()
+    for query in queries:
+        try:
+            outputs.append(function(query))
+        except Exception as e:
+            outputs.append(f"{type(e).__name__}: {e}")
+    return outputs, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that sql_normalization matches the reference implementation and time both.")
+    parser.add_argument("--gold_path", type=str, default=r'./dataset/spider/train_spider.json', help="Spider queries, synthesized ones when missing")
+    parser.add_argument("--n_queries", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    queries = load_queries(args)
+
+    expected, reference_time = run(reference_normalization, queries)
+    outputs, cold_time = run(sql_normalization.__wrapped__, queries)
+    run(sql_normalization, queries)
+    _, cached_time = run(sql_normalization, queries)
+    mismatches = [(query, out, exp) for query, out, exp in zip(queries, outputs, expected) if out != exp]
+    normalized = [out for out in expected if not out.endswith("!") and "Error" not in out]
+    tokens, _ = run(token_values, normalized)
+    parser_tokens, _ = run(lambda sql: [token.value for token in Parser(sql).tokens], normalized)
+    token_mismatches = sum(a != b for a, b in zip(tokens, parser_tokens))
+
+    if not FAST_PATH:
+        print("the installed sqlparse or sql_metadata is not supported by the lexer, all queries use sql_metadata")
+    print(f"{len(queries)} queries, {len(mismatches)} normalization and {token_mismatches} token mismatches")
+    for query, out, exp in mismatches[0:5]:
+        print(f"  {query!r}\n    got      {out!r}\n    expected {exp!r}")
+    print(f"reference: {reference_time / len(queries) * 1000:.3f} ms/query")
+    print(f"lexer:     {cold_time / len(queries) * 1000:.3f} ms/query ({reference_time / cold_time:.1f}x)")
+    print(f"memoized:  {cached_time / len(queries) * 1000:.3f} ms/query")
+
+
+if __name__ == '__main__':
+    main()
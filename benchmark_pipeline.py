@@ -0,0 +1,89 @@
+import argparse
+import collections
+import importlib
+import os
+import statistics
+import time
+
+from utils import fused
+from utils.evaluation import evaluate, extract_sql, load_gold
+from utils.execution import run_queries
+from utils.parallel import parallel_map
+
+# module of the LLM client each script sends its requests through
+BACKENDS = {"ask_llm": "llm.chatgpt", "ask_ollama": "llm.ollama"}
+
+
+def parse_args():
+    """Parse the benchmark's own arguments, the rest is passed on to the script."""
+    parser = argparse.ArgumentParser(description="Answer the same questions with the staged and the fused pipeline "
+                                                 "of ask_llm.py or ask_ollama.py and compare latency, tokens and correctness.")
+    parser.add_argument("--script", type=str, choices=["ask_llm.py", "ask_ollama.py"], default="ask_ollama.py")
+    parser.add_argument("--n_questions", type=int, default=50)
+    parser.add_argument("--gold_path", type=str, nargs="+", default=[r'./dataset/spider/dev.json'],
+                        help="Spider files with the gold SQL, execution without error is measured when missing")
+    return parser.parse_known_args()
+
+
+def run_mode(module, args, jobs, mode):
+    """Answer the jobs in mode, returning the answers with their latencies and the requests and tokens used."""
+    args.mode = mode
+    client = importlib.import_module(BACKENDS[module.__name__]).client
+    client.n_requests = client.n_tokens = 0
+    fused.stats.clear()
+    answer = module.answer_fused if mode == "fused" else module.answer_question
+
+    def timed(job):
+        start = time.perf_counter()
+        sql = answer(job[2], args, job[0], job[1])
+        return sql, time.perf_counter() - start
+
+    results = parallel_map(timed, jobs, args.concurrency)
+    return {
+        "answers": [sql for sql, _ in results],
+        "latencies": sorted(latency for _, latency in results),
+        "requests": client.n_requests,
+        "tokens": client.n_tokens,
+        "fallbacks": collections.Counter({outcome: n for outcome, n in fused.stats.items() if outcome != "fused"})
+    }
+
+
+def correctness(jobs, answers, gold_paths, args):
+    """Execution accuracy against the gold SQL when it is available, otherwise the share of answers that run."""
+    if all(os.path.exists(path) for path in gold_paths):
+        answered = {}
+        for (database, _, question), sql in zip(jobs, answers):
+            if sql is not None:
+                answered.setdefault(database, {})[question] = sql
+        records = evaluate(answered, load_gold(gold_paths))
+        return "execution accuracy", sum(record["execution"] for record in records) / max(len(records), 1)
+    queries = [(database, extract_sql(sql)) for (database, _, _), sql in zip(jobs, answers) if sql is not None]
+    results = run_queries(queries)
+    return "runs without error", sum(result["error"] is None for result in results) / max(len(jobs), 1)
+
+
+def main():
+    bench_args, script_argv = parse_args()
+    module = importlib.import_module(bench_args.script[:-len(".py")])
+    args = module.parse_args(script_argv)
+    # the cache would answer the second mode's staged fallbacks from the first mode's calls
+    args.cache_path = ""
+    tables = module.setup(args)
+    jobs = module.load_jobs(args, tables)[0:bench_args.n_questions]
+
+    print(f"{len(jobs)} questions, {bench_args.script} with {args.model}")
+    print(f"{'mode':<8}{'mean s':>8}{'p95 s':>8}{'calls/q':>9}{'tokens/q':>10}{'fallback':>10}  correctness")
+    for mode in ["staged", "fused"]:
+        run = run_mode(module, args, jobs, mode)
+        latencies = run["latencies"]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        metric, score = correctness(jobs, run["answers"], bench_args.gold_path, args)
+        fallback = f"{sum(run['fallbacks'].values()) / len(jobs) * 100:.0f}%" if mode == "fused" else "-"
+        print(f"{mode:<8}{statistics.fmean(latencies):>8.2f}{p95:>8.2f}"
+              f"{run['requests'] / len(jobs):>9.2f}{run['tokens'] / len(jobs):>10.0f}{fallback:>10}  {score * 100:.1f}% {metric}")
+        if run["fallbacks"]:
+            print(f"{'':<8}fallback reasons: {', '.join(f'{reason} {n}' for reason, n in run['fallbacks'].most_common())}")
+
+
+if __name__ == '__main__':
+    main()
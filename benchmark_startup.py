@@ -0,0 +1,85 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ENTRY_POINTS = [
+    "ask_llm.py",
+    "ask_ollama.py",
+    "build_catalog.py",
+    "evaluate.py",
+    "generate_query.py",
+    "get_valid_tables.py",
+    "merge_checkpoints.py",
+    "run_shards.py",
+    "test_ollama.py",
+    "test_openai.py",
+]
+# packages that no entry point needs before its first query
+HEAVY_MODULES = ["torch", "transformers", "networkx", "tqdm"]
+
+# runs the script up to argparse's --help exit and reports what the imports cost
+PROBE = """
+import resource, runpy, sys, time
+start = time.perf_counter()
+sys.argv = [{script!r}, "--help"]
+try:
+    runpy.run_path({script!r}, run_name="__main__")
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print("STARTUP", elapsed, rss, ",".join(heavy), file=sys.stderr)
+"""
+
+
+def measure(script, heavy_modules):
+    """Seconds until the script's arguments are parsed, peak RSS in MB and the heavy modules it imported."""
+    probe = PROBE.format(script=script, heavy=heavy_modules)
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-c", probe], cwd=os.path.dirname(script),
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - start
+    for line in process.stderr.splitlines():
+        if line.startswith("STARTUP "):
+            _, elapsed, rss, heavy = (line.split(" ") + [""])[0:4]
+            # ru_maxrss is in KB on Linux and in bytes on macOS
+            rss_mb = int(rss) / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+            return {"imports": float(elapsed), "wall": wall, "rss": rss_mb, "heavy": [name for name in heavy.split(",") if name]}
+    return {"imports": None, "wall": wall, "rss": None, "heavy": [], "error": process.stderr.strip().splitlines()[-1:]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the startup of every entry point and check it against a budget.")
+    parser.add_argument("--scripts", type=str, nargs="+", default=ENTRY_POINTS)
+    parser.add_argument("--max_seconds", type=float, default=1.5, help="Budget for the imports of each script")
+    parser.add_argument("--max_rss", type=float, default=150, help="Budget for the peak RSS of each script in MB")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per script, the fastest one counts")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    failures = []
+    print(f"{'script':<22}{'imports s':>10}{'wall s':>8}{'RSS MB':>8}  heavy modules")
+    for name in args.scripts:
+        runs = [measure(os.path.join(root, name), HEAVY_MODULES) for _ in range(args.repeat)]
+        if runs[0]["imports"] is None:
+            print(f"{name:<22} failed: {' '.join(runs[0]['error'])}")
+            failures.append(f"{name} failed to start")
+            continue
+        best = min(runs, key=lambda run: run["imports"])
+        print(f"{name:<22}{best['imports']:>10.3f}{best['wall']:>8.3f}{best['rss']:>8.0f}  {','.join(best['heavy']) or '-'}")
+        if best["imports"] > args.max_seconds:
+            failures.append(f"{name} imports take {best['imports']:.2f}s > {args.max_seconds}s")
+        if best["rss"] > args.max_rss:
+            failures.append(f"{name} uses {best['rss']:.0f}MB > {args.max_rss}MB")
+        if best["heavy"]:
+            failures.append(f"{name} imports {', '.join(best['heavy'])} at startup")
+    if failures:
+        sys.exit("Over budget:\n  " + "\n  ".join(failures))
+    print("All entry points within budget")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+import argparse
+from utils.catalog import build_catalog, Catalog
+from utils.value_index import ValueIndex
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default=r'./dataset/spider/database')
+    parser.add_argument("--save_path", type=str, default=r'./dataset/catalog.sqlite')
+    parser.add_argument("--value_index_path", type=str, default=r'./dataset/value_index.pkl', help="Also build the inverted value index, empty to skip")
+    parser.add_argument("--max_values", type=int, default=50, help="Number of distinct values kept per column")
+    parser.add_argument("--no_profiles", action="store_true", help="Skip the per-column statistics")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    build_catalog(args.data_dir, args.save_path, args.max_values, not args.no_profiles)
+    print(f"Catalog is successfully saved at {args.save_path}.")
+    if args.value_index_path:
+        # all distinct values, not only the samples of the catalog, so any value the question names can be found
+        ValueIndex.from_databases(Catalog(args.save_path), args.data_dir).save(args.value_index_path)
+        print(f"Value index is successfully saved at {args.value_index_path}.")
@@ -0,0 +1,63 @@
+import argparse
+import os
+import pickle
+
+from utils.evaluation import GoldCache, evaluate, load_gold, load_schemas
+from utils.execution import set_heap_limit
+
+
+def parse_args():
+    """Parse and return command-line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output_path", type=str, help="Result file of ask_llm.py / ask_ollama.py")
+    parser.add_argument("--gold_path", type=str, nargs="+", default=[r'./dataset/spider/dev.json'],
+                        help="Spider files with the gold SQL of the questions")
+    parser.add_argument("--tables_path", type=str, default=r'./dataset/spider/tables.json', help="Spider schemas, needed for skeleton match")
+    parser.add_argument("--gold_cache_path", type=str, default=r'./dataset/gold_cache.sqlite', help="Cache of gold results, empty to disable")
+    parser.add_argument("--result_folder", type=str, default=r'./results/')
+    parser.add_argument("--make_question_file", type=str, default="",
+                        help="Only write the questions of --gold_path in the layout of the fuzzy question files to this path")
+    parser.add_argument("--workers", type=int, default=8, help="Queries executed in parallel")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds a query may run before it is interrupted")
+    parser.add_argument("--max_rows", type=int, default=100000, help="Results with more rows count as failed")
+    parser.add_argument("--heap_limit", type=int, default=1024, help="MB SQLite may allocate for all queries together, 0 for no limit")
+    return parser.parse_args()
+
+
+def make_question_file(gold, path):
+    """Write the gold questions as {db_id: ["question\\nquestion..."]}, the input of the ask scripts."""
+    questions = {}
+    for db_id, question in gold:
+        questions.setdefault(db_id, []).append(question)
+    with open(path, 'wb') as file:
+        pickle.dump({db_id: ['\n'.join(db_questions)] for db_id, db_questions in questions.items()}, file)
+
+
+def main():
+    args = parse_args()
+    gold = load_gold(args.gold_path)
+    if args.make_question_file:
+        make_question_file(gold, args.make_question_file)
+        return
+
+    with open(args.output_path, 'rb') as file:
+        answers = pickle.load(file)
+    schemas = load_schemas(args.tables_path) if os.path.exists(args.tables_path) else None
+    cache = GoldCache(args.gold_cache_path) if args.gold_cache_path else None
+    if args.heap_limit:
+        set_heap_limit(args.heap_limit << 20)
+
+    records = evaluate(answers, gold, schemas, cache, args.workers, args.timeout, args.max_rows)
+    n_answers = sum(len(questions) for questions in answers.values())
+    print(f"Evaluated {len(records)} of {n_answers} answers, the others have no gold SQL")
+    if records:
+        for metric in ["execution", "exact", "skeleton"]:
+            print(f"{metric.capitalize()} accuracy: {sum(record[metric] for record in records) / len(records) * 100:.2f}%")
+        print(f"Gold queries that failed: {sum(record['gold_error'] is not None for record in records)}")
+
+    with open(args.result_folder + 'eval_' + os.path.basename(args.output_path), 'wb') as file:
+        pickle.dump(records, file)
+
+
+if __name__ == '__main__':
+    main()
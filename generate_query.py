@@ -1,8 +1,12 @@
+import os
 import pickle
 import argparse
-from llm.chatgpt import ask_llm, init_chatgpt
-from utils.chat2sql import get_columns, get_unique_values
+from llm.chatgpt import ask_llm, init_chatgpt, client
+from llm.rate_limit import RateLimiter, queue_key
+from llm.cache import init_cache, get_cache
+from utils.chat2sql import init_catalog, get_columns, get_representative_values
 from utils.enums import LLM
+from utils.prompt import fit_prompt
 import time
 
 def load_databases(file_path):
@@ -18,24 +22,16 @@ def get_columns_and_values(database, tables):
         columns_value = {}
         for col in columns:
             try:
-                columns_value[col] = get_unique_values(database, table, col)
+                columns_value[col] = get_representative_values(database, table, col)
             except:
                 print(f"Error processing table: {table}")
         columns_dic[table] = columns_value
     return columns_dic
 
-def generate_prompt(columns_dic, num_queries):
-    """Generate the prompt for the LLM based on the database dictionary."""
-    return f"""Generate {num_queries} natural language queries based on the dictionary of the database {columns_dic}. The structure is:
-    {{
-        "table1": {{
-            "column1": ["value1", "value2"],
-            "column2": ["value3"]
-        }},
-        "table2": {{
-            ...
-        }}
-    }}
+def generate_prompt(schema, num_queries):
+    """Generate the prompt for the LLM based on the tables of the database."""
+    return f"""Generate {num_queries} natural language queries based on the database below. Each line is a table as table(column: value1 | value2, ...).
+    {schema}
     You should generate fuzzy queries that do not specify column values or use another naming style if available.
     You should not specify table names. For example, a possible output is: "Select all the colleges in Texas"."""
 
@@ -43,11 +39,19 @@ def process_databases(args):
     """Process all databases and generate queries using the LLM."""
     db_dic = {}
     init_chatgpt(args.openai_api_key)
+    if args.rpm or args.tpm:
+        client.rate_limiter = RateLimiter(args.rpm, args.tpm)
+    if args.cache_path:
+        init_cache(args.cache_path, args.cache_size, bypass=args.no_cache)
     databases = load_databases(args.tables_path)
+    if os.path.exists(args.catalog_path):
+        init_catalog(args.catalog_path)
     for database, tables in databases.items():
         if tables:
             columns_dic = get_columns_and_values(database, tables)
-            prompt = generate_prompt(columns_dic, args.num_queries)
+            prompt = fit_prompt(lambda schema: generate_prompt(schema, args.num_queries), columns_dic,
+                                args.model, args.prompt_budget)
+            queue_key.set(database)
             try:            
                 resp = ask_llm(args.model, [prompt], args.temperature, args.n)
                 # time.sleep(1)
@@ -58,7 +62,9 @@ def process_databases(args):
                     print(f"Rate limit hit for {database}.")
                 else:
                     print(f"Error processing {database}: {e}")
-                    
+
+    if args.cache_path:
+        print(f"LLM cache: {get_cache().stats()}")
     return db_dic
 
 def main(args):
@@ -79,6 +85,13 @@ if __name__ == '__main__':
     parser.add_argument("--n", type=int, default=1)
     parser.add_argument("--num_queries", type=int, default=1)
     parser.add_argument("--tables_path", type=str, default="./dataset/valid_tables.pkl")
+    parser.add_argument("--rpm", type=int, default=None, help="Requests per minute allowed by the provider")
+    parser.add_argument("--tpm", type=int, default=None, help="Tokens per minute allowed by the provider")
+    parser.add_argument("--cache_path", type=str, default="./dataset/llm_cache.sqlite", help="LLM response cache, empty to disable")
+    parser.add_argument("--cache_size", type=int, default=100000, help="Maximum number of cached responses")
+    parser.add_argument("--no_cache", action="store_true", help="Ignore cached responses but still store new ones")
+    parser.add_argument("--prompt_budget", type=int, default=None, help="Maximum tokens of a prompt, defaults to what the model's context window allows")
+    parser.add_argument("--catalog_path", type=str, default="./dataset/catalog.sqlite", help="Catalog built by build_catalog.py, used when it exists")
     args = parser.parse_args()
     db_dic = main(args)
     
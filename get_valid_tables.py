@@ -1,45 +1,66 @@
 import os
-import sqlite3
 import pickle
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from utils.pool import get_pool
 
-def get_tables_with_data(db_path):
-    """Retrieve tables with non-empty content from a database."""
+def get_table_stats(cursor, table):
+    """Count rows, non-null and distinct values of every column in one pass over the table."""
+    columns = [row[1] for row in cursor.execute(f'PRAGMA table_info("{table}")')]
+    aggregates = ["COUNT(*)"]
+    for column in columns:
+        aggregates += [f'COUNT("{column}")', f'COUNT(DISTINCT "{column}")']
+    row = cursor.execute(f"SELECT {', '.join(aggregates)} FROM {table}").fetchone()
+    return {
+        "row_count": row[0],
+        "columns": {column: {"non_null": row[1 + 2 * i], "distinct": row[2 + 2 * i]} for i, column in enumerate(columns)}
+    }
+
+def get_tables_with_data(db_path, with_stats=False):
+    """Retrieve tables with non-empty content from a database, and optionally their statistics."""
+    valid_tables = []
+    stats = {}
     try:
-        connection = sqlite3.connect(db_path)
-        cursor = connection.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-
-        valid_tables = []
-        for table in tables:
-            try:
-                cursor.execute(f"SELECT * FROM {table[0]}")
-                content = cursor.fetchall()
-                # Decode content to UTF-8 with error handling
-                for row in content:
-                    row = [str(cell).encode('utf-8', errors='ignore').decode('utf-8') if isinstance(cell, str) else cell for cell in row]
-                if content:
-                    valid_tables.append(table[0])
-            except Exception as e:
-                print(f"Error reading table {table[0]} in {db_path}: {e}")
-        return valid_tables
+        with get_pool().connection(db_path=db_path) as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+            tables = cursor.fetchall()
+
+            for table in tables:
+                try:
+                    # stops at the first row instead of reading the whole table, fetching it still
+                    # decodes its text, so a table with text that is not UTF-8 is dropped
+                    cursor.execute(f"SELECT * FROM {table[0]} LIMIT 1")
+                    if cursor.fetchone() is not None:
+                        valid_tables.append(table[0])
+                    if with_stats:
+                        stats[table[0]] = get_table_stats(cursor, table[0])
+                except Exception as e:
+                    print(f"Error reading table {table[0]} in {db_path}: {e}")
     except Exception as e:
         print(f"Error processing {db_path}: {e}")
-        return []
+    return valid_tables, stats
+
+def scan_database(job):
+    db_path, with_stats = job
+    return get_tables_with_data(db_path, with_stats)
 
-def process_databases(db_dir):
-    """Process all databases in the given directory and return a record of valid tables."""
+def process_databases(db_dir, workers=None, with_stats=False):
+    """Process all databases in the given directory and return a record of valid tables and their statistics."""
     record = {}
+    stats = {}
     databases = os.listdir(db_dir)
-    
-    for db_name in databases:
-        db_path = os.path.join(db_dir, db_name, f"{db_name}.sqlite")
-        valid_tables = get_tables_with_data(db_path)
-        if valid_tables:
-            record[db_name] = valid_tables
-            
-    return record
+    jobs = [(os.path.join(db_dir, db_name, f"{db_name}.sqlite"), with_stats) for db_name in databases]
+
+    # databases are independent, so they are scanned in a process pool
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for db_name, (valid_tables, db_stats) in zip(databases, executor.map(scan_database, jobs)):
+            if valid_tables:
+                record[db_name] = valid_tables
+            if db_stats:
+                stats[db_name] = db_stats
+
+    return record, stats
 
 def save_valid_tables(record, file_path):
     """Save the record of valid tables to a pickle file."""
@@ -51,11 +72,17 @@ def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--data_dir", type=str, default=r'./dataset/spider/database')
     parser.add_argument("--save_path", type=str, default=r'./dataset/valid_tables.pkl')
+    parser.add_argument("--stats_path", type=str, default="", help="Also save row counts and column statistics to this file")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes, defaults to the number of CPUs")
     return parser.parse_args()
 
 if __name__ == '__main__':
     args = parse_args()
     data_dir = args.data_dir
     save_path = args.save_path
-    record = process_databases(data_dir)
+    record, stats = process_databases(data_dir, args.workers, with_stats=bool(args.stats_path))
     save_valid_tables(record, save_path)
+    if args.stats_path:
+        with open(args.stats_path, 'wb') as file:
+            pickle.dump(stats, file)
+        print(f"Table statistics are successfully saved at {args.stats_path}.")
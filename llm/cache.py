@@ -0,0 +1,90 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    """Persistent LLM response cache stored in a SQLite file.
+
+    Entries are keyed by a hash of everything that determines the response and evicted
+    least-recently-used first once there are more than `max_entries`, or after `ttl` seconds.
+    With `bypass` set, lookups always miss but fresh responses are still stored.
+    """
+
+    def __init__(self, path, max_entries=100000, ttl=None, bypass=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, response TEXT, created REAL, last_access REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self.connection.commit()
+        self.n_entries = self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def make_key(backend, model, prompt, temperature, n, max_tokens):
+        payload = json.dumps([backend, model, prompt, temperature, n, max_tokens], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the cached response for key, or None on a miss."""
+        with self.lock:
+            row = None
+            if not self.bypass:
+                row = self.connection.execute(
+                    "SELECT response, created FROM entries WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.connection.commit()
+                self.n_entries -= 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key, response):
+        with self.lock:
+            now = time.time()
+            exists = self.connection.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, json.dumps(response), now, now))
+            self.n_entries += exists is None
+            if self.n_entries > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_access LIMIT ?)",
+                    (self.n_entries - self.max_entries,))
+                self.n_entries = self.max_entries
+            self.connection.commit()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": self.n_entries}
+
+    def close(self):
+        self.connection.close()
+
+
+_cache = None
+
+
+def init_cache(path, max_entries=100000, ttl=None, bypass=False):
+    """Enable the response cache for all backends in `llm/`."""
+    global _cache
+    _cache = ResponseCache(path, max_entries, ttl, bypass)
+    return _cache
+
+
+def get_cache():
+    return _cache
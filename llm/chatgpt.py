@@ -1,8 +1,93 @@
 import json.decoder
 
 import openai
+from llm.client import LLMClient, Provider
 from utils.enums import LLM
-import time
+
+# maximum number of requests in flight against the OpenAI API
+MAX_CONCURRENCY = 8
+MAX_TOKENS = 200
+
+
+class OpenAIProvider(Provider):
+    name = "openai"
+    max_tokens = MAX_TOKENS
+    retryable = (
+        openai.error.RateLimitError,
+        openai.error.APIError,
+        openai.error.Timeout,
+        openai.error.APIConnectionError,
+        openai.error.ServiceUnavailableError,
+        openai.error.TryAgain,
+        json.decoder.JSONDecodeError
+    )
+
+    def is_retryable(self, error):
+        return isinstance(error, self.retryable)
+
+    def is_rate_limit(self, error):
+        return isinstance(error, openai.error.RateLimitError)
+
+    def error_headers(self, error):
+        return getattr(error, "headers", None)
+
+    def completion(self, client, model, batch, temperature):
+        response = openai.Completion.create(
+            model=model,
+            prompt=batch,
+            temperature=temperature,
+            max_tokens=self.max_tokens,
+            top_p=1,
+            frequency_penalty=0,
+            presence_penalty=0,
+            stop=[";"],
+            request_timeout=client.timeout
+        )
+        # one choice per prompt, put back in prompt order
+        response_clean = [_["text"] for _ in sorted(response["choices"], key=lambda choice: choice["index"])]
+        return dict(
+            response=response_clean,
+            **response["usage"]
+        )
+
+    def chat(self, client, model, messages: list, temperature, n):
+        response = openai.ChatCompletion.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=self.max_tokens,
+            n=n,
+            request_timeout=client.timeout
+        )
+        response_clean = [choice["message"]["content"] for choice in response["choices"]]
+        if n == 1:
+            response_clean = response_clean[0]
+        return dict(
+            response=response_clean,
+            **response["usage"]
+        )
+
+    def supports_batch(self, model):
+        return model in LLM.BATCH_FORWARD
+
+    def ask(self, client, model, batch, temperature, n, until=None):
+        if model in LLM.TASK_COMPLETIONS:
+            # TODO: self-consistency in this mode
+            assert n == 1
+            return self.completion(client, model, batch, temperature)
+        elif model in LLM.TASK_CHAT:
+            # batch size must be 1
+            assert len(batch) == 1, "batch must be 1 in this mode"
+            messages = [{"role": "user", "content": batch[0]}]
+            response = self.chat(client, model, messages, temperature, n)
+            response['response'] = [response['response']]
+            return response
+        raise ValueError(f"{model} is neither a completion nor a chat model")
+
+
+client = LLMClient(OpenAIProvider(), MAX_CONCURRENCY)
+# let the openai package reuse the client's keep-alive connections
+openai.requestssession = client.session
 
 
 def init_chatgpt(OPENAI_API_KEY):
@@ -11,70 +96,12 @@ def init_chatgpt(OPENAI_API_KEY):
 
 
 def ask_completion(model, batch, temperature):
-    response = openai.Completion.create(
-        model=model,
-        prompt=batch,
-        temperature=temperature,
-        max_tokens=200,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0,
-        stop=[";"]
-    )
-    response_clean = [_["text"] for _ in response["choices"]]
-    return dict(
-        response=response_clean,
-        **response["usage"]
-    )
+    return client.provider.completion(client, model, batch, temperature)
 
 
 def ask_chat(model, messages: list, temperature, n):
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-        max_tokens=200,
-        n=n
-    )
-    response_clean = [choice["message"]["content"] for choice in response["choices"]]
-    if n == 1:
-        response_clean = response_clean[0]
-    return dict(
-        response=response_clean,
-        **response["usage"]
-    )
-
+    return client.provider.chat(client, model, messages, temperature, n)
 
-def ask_llm(model: str, batch: list, temperature: float, n:int):
-    n_repeat = 0
-    while True:
-        try:
-            if model in LLM.TASK_COMPLETIONS:
-                # TODO: self-consistency in this mode
-                assert n == 1
-                response = ask_completion(model, batch, temperature)
-            elif model in LLM.TASK_CHAT:
-                # batch size must be 1
-                assert len(batch) == 1, "batch must be 1 in this mode"
-                messages = [{"role": "user", "content": batch[0]}]
-                response = ask_chat(model, messages, temperature, n)
-                response['response'] = [response['response']]
-            break
-        except openai.error.RateLimitError:
-            n_repeat += 1
-            print(f"Repeat for the {n_repeat} times for RateLimitError", end="\n")
-            time.sleep(1)
-            continue
-        except json.decoder.JSONDecodeError:
-            n_repeat += 1
-            print(f"Repeat for the {n_repeat} times for JSONDecodeError", end="\n")
-            time.sleep(1)
-            continue
-        except Exception as e:
-            n_repeat += 1
-            print(f"Repeat for the {n_repeat} times for exception: {e}", end="\n")
-            time.sleep(1)
-            continue
-
-    return response
 
+def ask_llm(model: str, batch: list, temperature: float, n:int, until=None):
+    return client.ask(model, batch, temperature, n, until)
@@ -0,0 +1,183 @@
+import asyncio
+import json
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from llm.cache import get_cache
+from llm.rate_limit import queue_key, estimate_tokens, get_retry_after
+from utils.parallel import parallel_map
+
+# HTTP status codes worth another attempt, anything else in 4xx is a bad request
+RETRY_STATUS = (408, 409, 429, 500, 502, 503, 504)
+
+
+def merge_responses(responses):
+    """Concatenate the responses of several requests and add up their token usage."""
+    merged = {"response": [r for response in responses for r in response["response"]]}
+    for response in responses:
+        for key, value in response.items():
+            if key == "response":
+                continue
+            if isinstance(value, dict):
+                usage = merged.setdefault(key, {})
+                for usage_key, count in value.items():
+                    usage[usage_key] = usage.get(usage_key, 0) + count
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+class Provider:
+    """Backend specific part of a request, plugged into an `LLMClient`.
+
+    Subclasses build the request for their API in `ask` and return a dict with at least a "response" key.
+    `until` is a predicate on the text generated so far: providers that stream their response stop
+    reading, and so generating, once it holds, the others ignore it.
+    """
+    name = "provider"
+    max_tokens = 200
+    retryable = (requests.exceptions.RequestException, json.decoder.JSONDecodeError)
+
+    def ask(self, client, model, batch, temperature, n, until=None):
+        raise NotImplementedError
+
+    def supports_batch(self, model):
+        """Whether a list of prompts can be sent to model in one request."""
+        return True
+
+    def is_retryable(self, error):
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+            return error.response.status_code in RETRY_STATUS
+        return isinstance(error, self.retryable)
+
+    def is_rate_limit(self, error):
+        return isinstance(error, requests.exceptions.HTTPError) and error.response is not None \
+            and error.response.status_code == 429
+
+    def error_headers(self, error):
+        response = getattr(error, "response", None)
+        return getattr(response, "headers", None)
+
+    def used_tokens(self, response):
+        usage = response.get("usage", response)
+        return usage.get("total_tokens")
+
+
+class LLMClient:
+    """Shared request machinery for all backends.
+
+    Keeps a keep-alive HTTP connection pool, bounds the requests in flight, applies per-request
+    timeouts, retries transient errors with exponential backoff and jitter, and consults the
+    response cache of `llm.cache`. An optional `rate_limiter` (see `llm.rate_limit`) keeps
+    requests within the provider's request and token budgets.
+    """
+
+    def __init__(self, provider, max_concurrency=8, max_retries=8, timeout=120, backoff=1.0, max_backoff=60.0,
+                 rate_limiter=None):
+        self.provider = provider
+        self.rate_limiter = rate_limiter
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        # requests sent and tokens they used, cached responses are not counted
+        self.stats_lock = threading.Lock()
+        self.n_requests = 0
+        self.n_tokens = 0
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # every response of the session updates the budgets, also those of SDKs sharing it like openai's
+        self.session.hooks["response"].append(self.read_rate_limits)
+
+    def read_rate_limits(self, response, *args, **kwargs):
+        if self.rate_limiter is not None:
+            self.rate_limiter.update_from_headers(response.headers)
+
+    def post(self, url, data):
+        response = self.session.post(url, json=data, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def post_stream(self, url, data, until):
+        """Read a streamed chat completion until `until` holds for its text, return the text and the usage if sent.
+
+        Leaving the stream early closes the connection, which makes the server stop generating.
+        """
+        text, usage = "", {}
+        with self.session.post(url, json=data, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                chunk = json.loads(payload)
+                usage = chunk.get("usage") or usage
+                for choice in chunk.get("choices", []):
+                    text += (choice.get("delta") or {}).get("content") or ""
+                if until(text):
+                    break
+        return text, usage
+
+    def retry_delay(self, n_repeat):
+        delay = min(self.max_backoff, self.backoff * 2 ** (n_repeat - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def ask(self, model, batch, temperature, n, until=None):
+        if not isinstance(batch, str) and len(batch) > 1 and not self.provider.supports_batch(model):
+            # one request per prompt, sent at the same time and merged back in order
+            responses = parallel_map(lambda prompt: self.ask(model, [prompt], temperature, n, until), batch,
+                                     self.max_concurrency)
+            return merge_responses(responses)
+
+        cache = get_cache()
+        if cache is not None:
+            key = cache.make_key(self.provider.name, model, batch, temperature, n, self.provider.max_tokens)
+            response = cache.get(key)
+            if response is not None:
+                return response
+
+        # reserve the prompt plus the longest possible completion, corrected once the usage is known
+        n_prompts = 1 if isinstance(batch, str) else len(batch)
+        reserved_tokens = estimate_tokens(batch) + self.provider.max_tokens * n * n_prompts
+        n_repeat = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(reserved_tokens, queue_key.get())
+            try:
+                with self.slots:
+                    response = self.provider.ask(self, model, batch, temperature, n, until)
+                if self.rate_limiter is not None:
+                    self.rate_limiter.record_usage(reserved_tokens, self.provider.used_tokens(response))
+                with self.stats_lock:
+                    self.n_requests += 1
+                    self.n_tokens += self.provider.used_tokens(response) or 0
+                break
+            except Exception as e:
+                if self.rate_limiter is not None:
+                    # a failed attempt returns its reservation, the retry reserves again
+                    self.rate_limiter.release(reserved_tokens)
+                    if self.provider.is_rate_limit(e):
+                        self.rate_limiter.record_rate_limit(get_retry_after(self.provider.error_headers(e)))
+                if not self.provider.is_retryable(e) or n_repeat >= self.max_retries:
+                    raise
+                n_repeat += 1
+                print(f"Repeat for the {n_repeat} times for {type(e).__name__}: {e}", end="\n")
+                time.sleep(self.retry_delay(n_repeat))
+
+        if cache is not None:
+            cache.put(key, response)
+        return response
+
+    async def ask_async(self, model, batch, temperature, n, until=None):
+        """Awaitable version of `ask`, the blocking request runs in the default executor."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.ask, model, batch, temperature, n, until)
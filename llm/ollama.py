@@ -1,67 +1,76 @@
-import time
-import requests
-import json
+from llm.client import LLMClient, Provider
+from llm.rate_limit import estimate_tokens
 
 OLLAMA_SERVER_URL = "http://localhost:11434/v1/chat/completions"
+# maximum number of requests in flight against the Ollama server
+MAX_CONCURRENCY = 16
+MAX_TOKENS = 200
+
+
+class OllamaProvider(Provider):
+    name = "ollama"
+    max_tokens = MAX_TOKENS
+
+    def __init__(self, url=OLLAMA_SERVER_URL):
+        self.url = url
+
+    def completion(self, client, model, batch, temperature, until=None):
+        data = {
+            "model": model,
+            "messages": [{"role": "user", "content": batch}],
+            "temperature": temperature,
+            "max_tokens": self.max_tokens,
+            "top_p": 1,
+            "frequency_penalty": 0,
+            "presence_penalty": 0,
+            "stop": [";"]
+        }
+        if until is not None:
+            data["stream"] = True
+            data["stream_options"] = {"include_usage": True}
+            text, usage = client.post_stream(self.url, data, until)
+            # a stream left early ends before its usage, so the tokens are estimated
+            return {
+                "response": text,
+                "usage": usage or {"total_tokens": estimate_tokens(batch) + estimate_tokens(text)}
+            }
+        result = client.post(self.url, data)
+        return {
+            "response": result["choices"][0]["message"]['content'],
+            "usage": result.get("usage", {})
+        }
+
+    def chat(self, client, model, messages: list, temperature, n):
+        data = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": self.max_tokens,
+            "n": n
+        }
+        result = client.post(self.url, data)
+        response_clean = [choice["message"]["content"] for choice in result["choices"]]
+        if n == 1:
+            response_clean = response_clean[0]
+        return {
+            "response": response_clean,
+            "usage": result.get("usage", {})
+        }
+
+    def ask(self, client, model, batch, temperature, n, until=None):
+        return self.completion(client, model, batch, temperature, until)
+
+
+client = LLMClient(OllamaProvider(), MAX_CONCURRENCY)
+
 
 def ask_completion(model, batch, temperature):
-    data = {
-        "model": model,
-        "messages": [{"role": "user", "content": batch}],
-        "temperature": temperature,
-        "max_tokens": 200,
-        "top_p": 1,
-        "frequency_penalty": 0,
-        "presence_penalty": 0,
-        "stop": [";"]
-    }
-    response = requests.post(f"{OLLAMA_SERVER_URL}", json=data)
-    response.raise_for_status()
-    result = response.json()
-    return {
-        "response": result["choices"][0]["message"]['content'],
-        "usage": result.get("usage", {})
-    }
+    return client.provider.completion(client, model, batch, temperature)
+
 
 def ask_chat(model, messages: list, temperature, n):
-    data = {
-        "model": model,
-        "messages": messages,
-        "temperature": temperature,
-        "max_tokens": 200,
-        "n": n
-    }
-    response = requests.post(f"{OLLAMA_SERVER_URL}", json=data)
-    response.raise_for_status()
-    result = response.json()
-    response_clean = [choice["message"]["content"] for choice in result["choices"]]
-    if n == 1:
-        response_clean = response_clean[0]
-    return {
-        "response": response_clean,
-        "usage": result.get("usage", {})
-    }
+    return client.provider.chat(client, model, messages, temperature, n)
 
-def ask_llm(model: str, batch: list, temperature: float, n: int):
-    n_repeat = 0
-    while True:
-        try:
-            response = ask_completion(model, batch, temperature)
-            break
-        except requests.exceptions.RequestException as e:
-            n_repeat += 1
-            print(f"Repeat for the {n_repeat} times for RequestException: {e}", end="\n")
-            time.sleep(1)
-            continue
-        except json.decoder.JSONDecodeError:
-            n_repeat += 1
-            print(f"Repeat for the {n_repeat} times for JSONDecodeError", end="\n")
-            time.sleep(1)
-            continue
-        except Exception as e:
-            n_repeat += 1
-            print(f"Repeat for the {n_repeat} times for exception: {e}", end="\n")
-            time.sleep(1)
-            continue
 
-    return response
+def ask_llm(model: str, batch: list, temperature: float, n: int, until=None):
+    return client.ask(model, batch, temperature, n, until)
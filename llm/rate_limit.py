@@ -0,0 +1,146 @@
+import contextvars
+import re
+import threading
+import time
+from collections import defaultdict
+
+# the unit of work a request belongs to (e.g. its database), waiting requests are served round-robin over keys
+queue_key = contextvars.ContextVar("queue_key", default=None)
+
+
+def estimate_tokens(batch):
+    """Rough prompt size in tokens, about four characters per token."""
+    if isinstance(batch, str):
+        batch = [batch]
+    return sum(len(prompt) // 4 + 1 for prompt in batch)
+
+
+def parse_reset(value):
+    """Parse reset durations like "1s", "6m0s" or "250ms" from rate-limit headers into seconds."""
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|s|m|h)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+
+class RateLimiter:
+    """Client-side requests-per-minute and tokens-per-minute budget shared by all threads.
+
+    Both budgets refill continuously. The request rate backs off multiplicatively on 429 responses
+    and recovers additively on successes, and budgets are clamped to what the provider's
+    rate-limit headers report as remaining. Waiting requests are served round-robin over queue keys.
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.current_rpm = rpm
+        self.requests_left = float(rpm) if rpm else None
+        self.tokens_left = float(tpm) if tpm else None
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.served = defaultdict(int)
+        self.n_tickets = 0
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        if self.rpm:
+            self.requests_left = min(self.current_rpm, self.requests_left + elapsed * self.current_rpm / 60)
+        if self.tpm:
+            self.tokens_left = min(self.tpm, self.tokens_left + elapsed * self.tpm / 60)
+
+    def _wait_time(self, now, n_tokens):
+        wait = self.paused_until - now
+        if self.rpm and self.requests_left < 1:
+            wait = max(wait, (1 - self.requests_left) * 60 / self.current_rpm)
+        if self.tpm and self.tokens_left < n_tokens:
+            wait = max(wait, (n_tokens - self.tokens_left) * 60 / self.tpm)
+        return wait
+
+    def acquire(self, n_tokens, key=None):
+        """Block until a request of about n_tokens tokens fits in the budget."""
+        if self.tpm:
+            # a request larger than the whole budget would wait forever
+            n_tokens = min(n_tokens, self.tpm)
+        with self.condition:
+            waiting_keys = {t[1] for t in self.waiting}
+            if waiting_keys and key not in waiting_keys:
+                # a key that (re)joins the queue starts level with the others instead of owning it
+                self.served[key] = max(self.served[key], min(self.served[k] for k in waiting_keys))
+            ticket = (self.n_tickets, key)
+            self.n_tickets += 1
+            self.waiting.append(ticket)
+            while True:
+                head = min(self.waiting, key=lambda t: (self.served[t[1]], t[0]))
+                if head is ticket:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = self._wait_time(now, n_tokens)
+                    if wait <= 0:
+                        break
+                    self.condition.wait(wait)
+                else:
+                    self.condition.wait()
+            self.waiting.remove(ticket)
+            self.served[key] += 1
+            if self.rpm:
+                self.requests_left -= 1
+            if self.tpm:
+                self.tokens_left -= n_tokens
+            self.condition.notify_all()
+
+    def record_usage(self, reserved_tokens, used_tokens):
+        """Correct the token budget once the real usage of a request is known."""
+        with self.condition:
+            if self.tpm and used_tokens is not None:
+                self.tokens_left += reserved_tokens - used_tokens
+            if self.rpm:
+                self.current_rpm = min(self.rpm, self.current_rpm + 1)
+
+    def release(self, reserved_tokens):
+        """Give back the tokens reserved by a request that failed."""
+        with self.condition:
+            if self.tpm:
+                self.tokens_left = min(self.tpm, self.tokens_left + reserved_tokens)
+            self.condition.notify_all()
+
+    def record_rate_limit(self, retry_after=None):
+        """Slow down after a 429 response."""
+        with self.condition:
+            if self.rpm:
+                self.current_rpm = max(1, self.current_rpm * 0.75)
+                self.requests_left = min(self.requests_left, 0)
+            self.paused_until = max(self.paused_until, time.monotonic() + (retry_after or 1))
+            self.condition.notify_all()
+
+    def update_from_headers(self, headers):
+        """Clamp the budgets to the remaining quota reported by OpenAI-style rate-limit headers."""
+        if not headers:
+            return
+        with self.condition:
+            self._refill(time.monotonic())
+            remaining_requests = headers.get("x-ratelimit-remaining-requests")
+            if self.rpm and remaining_requests is not None:
+                self.requests_left = min(self.requests_left, float(remaining_requests))
+            remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+            if self.tpm and remaining_tokens is not None:
+                self.tokens_left = min(self.tokens_left, float(remaining_tokens))
+            if remaining_requests is not None and float(remaining_requests) < 1:
+                reset = parse_reset(headers.get("x-ratelimit-reset-requests", ""))
+                self.paused_until = max(self.paused_until, time.monotonic() + reset)
+
+
+def get_retry_after(headers):
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    if value is not None:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    reset = headers.get("x-ratelimit-reset-requests")
+    return parse_reset(reset) if reset else None
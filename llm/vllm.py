@@ -1,77 +1,82 @@
-import time
-import requests
-import json
+from llm.client import LLMClient, Provider
 from utils.enums import LLM
 
 VLLM_SERVER_URL = "http://127.0.0.1:5000"
+# maximum number of requests in flight against the vLLM server
+MAX_CONCURRENCY = 64
+MAX_TOKENS = 200
+
+
+class VLLMProvider(Provider):
+    name = "vllm"
+    max_tokens = MAX_TOKENS
+
+    def __init__(self, url=VLLM_SERVER_URL):
+        self.url = url
+
+    def completion(self, client, model, batch, temperature):
+        data = {
+            "model": model,
+            "prompt": batch,
+            "temperature": temperature,
+            "max_tokens": self.max_tokens,
+            "top_p": 1,
+            "frequency_penalty": 0,
+            "presence_penalty": 0,
+            "stop": [";"]
+        }
+        result = client.post(f"{self.url}/generate", data)
+        return {
+            # one choice per prompt, put back in prompt order
+            "response": [choice["text"] for choice in sorted(result["choices"], key=lambda choice: choice.get("index", 0))],
+            "usage": result["usage"]
+        }
+
+    def chat(self, client, model, messages: list, temperature, n):
+        data = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": self.max_tokens,
+            "n": n
+        }
+        result = client.post(f"{self.url}/chat", data)
+        response_clean = [choice["message"]["content"] for choice in result["choices"]]
+        if n == 1:
+            response_clean = response_clean[0]
+        return {
+            "response": response_clean,
+            "usage": result["usage"]
+        }
+
+    def supports_batch(self, model):
+        return model in LLM.BATCH_FORWARD
+
+    def ask(self, client, model, batch, temperature, n, until=None):
+        if model in LLM.TASK_COMPLETIONS:
+            # TODO: self-consistency in this mode
+            assert n == 1
+            return self.completion(client, model, batch, temperature)
+        elif model in LLM.TASK_CHAT:
+            # batch size must be 1
+            assert len(batch) == 1, "batch must be 1 in this mode"
+            messages = [{"role": "user", "content": batch[0]}]
+            response = self.chat(client, model, messages, temperature, n)
+            response['response'] = [response['response']]
+            return response
+        raise ValueError(f"{model} is neither a completion nor a chat model")
+
+
+client = LLMClient(VLLMProvider(), MAX_CONCURRENCY)
+
 
 def ask_completion(model, batch, temperature):
-    data = {
-        "model": model,
-        "prompt": batch,
-        "temperature": temperature,
-        "max_tokens": 200,
-        "top_p": 1,
-        "frequency_penalty": 0,
-        "presence_penalty": 0,
-        "stop": [";"]
-    }
-    response = requests.post(f"{VLLM_SERVER_URL}/generate", json=data)
-    response.raise_for_status()
-    result = response.json()
-    return {
-        "response": [choice["text"] for choice in result["choices"]],
-        "usage": result["usage"]
-    }
+    return client.provider.completion(client, model, batch, temperature)
+
 
 def ask_chat(model, messages: list, temperature, n):
-    data = {
-        "model": model,
-        "messages": messages,
-        "temperature": temperature,
-        "max_tokens": 200,
-        "n": n
-    }
-    response = requests.post(f"{VLLM_SERVER_URL}/chat", json=data)
-    response.raise_for_status()
-    result = response.json()
-    response_clean = [choice["message"]["content"] for choice in result["choices"]]
-    if n == 1:
-        response_clean = response_clean[0]
-    return {
-        "response": response_clean,
-        "usage": result["usage"]
-    }
-
-def ask_llm(model: str, batch: list, temperature: float, n: int):
-    n_repeat = 0
-    while True:
-        try:
-            if model in LLM.TASK_COMPLETIONS:
-                # TODO: self-consistency in this mode
-                assert n == 1
-                response = ask_completion(model, batch, temperature)
-            elif model in LLM.TASK_CHAT:
-                # batch size must be 1
-                assert len(batch) == 1, "batch must be 1 in this mode"
-                messages = [{"role": "user", "content": batch[0]}]
-                response = ask_chat(model, messages, temperature, n)
-                response['response'] = [response['response']]
-            break
-        except requests.exceptions.RequestException as e:
-            n_repeat += 1
-            print(f"Repeat for the {n_repeat} times for RequestException: {e}", end="\n")
-            time.sleep(1)
-            continue
-        except json.decoder.JSONDecodeError:
-            n_repeat += 1
-            print(f"Repeat for the {n_repeat} times for JSONDecodeError", end="\n")
-            time.sleep(1)
-            continue
-        except Exception as e:
-            n_repeat += 1
-            print(f"Repeat for the {n_repeat} times for exception: {e}", end="\n")
-            time.sleep(1)
-            continue
-
-    return response
+    return client.provider.chat(client, model, messages, temperature, n)
+
+
+def ask_llm(model: str, batch: list, temperature: float, n: int, until=None):
+    return client.ask(model, batch, temperature, n, until)
@@ -0,0 +1,24 @@
+import argparse
+import pickle
+
+from utils.checkpoint import merge_checkpoints
+
+
+def parse_args():
+    """Parse and return command-line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checkpoints", type=str, nargs="+", required=True, help="Checkpoint logs of the runs to merge")
+    parser.add_argument("--output_path", type=str, required=True, help="Result file in the layout of ask_llm.py / ask_ollama.py")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    result = merge_checkpoints(args.checkpoints)
+    print(f"Merged {sum(len(questions) for questions in result.values())} answers of {len(result)} databases")
+    with open(args.output_path, 'wb') as file:
+        pickle.dump(result, file)
+
+
+if __name__ == '__main__':
+    main()
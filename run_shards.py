@@ -0,0 +1,64 @@
+import argparse
+import copy
+import importlib
+import os
+import pickle
+import subprocess
+import sys
+
+from utils.parallel import parallel_map
+
+
+def parse_args():
+    """Parse the runner's own arguments, the rest is passed on to every shard."""
+    parser = argparse.ArgumentParser(description="Split a run of ask_llm.py or ask_ollama.py into shards of databases, "
+                                                 "run them as separate processes and merge their results.")
+    parser.add_argument("--script", type=str, choices=["ask_llm.py", "ask_ollama.py"], default="ask_ollama.py")
+    parser.add_argument("--num_shards", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=None, help="Shards running at the same time, defaults to all of them")
+    parser.add_argument("--print_commands", action="store_true", help="Only print the command of every shard, e.g. to run them on other hosts")
+    parser.add_argument("--merge_only", action="store_true", help="Only merge the results of shards that already ran")
+    return parser.parse_known_args()
+
+
+def shard_command(script, script_argv, shard_index, num_shards):
+    return [sys.executable, script] + script_argv + ["--shard_index", str(shard_index), "--num_shards", str(num_shards)]
+
+
+def merge_shards(module, script_args, num_shards):
+    """Merge the result files of all shards into the result file of an unsharded run."""
+    result = {}
+    for shard_index in range(num_shards):
+        shard_args = copy.copy(script_args)
+        shard_args.shard_index, shard_args.num_shards = shard_index, num_shards
+        with open(module.get_output_path(shard_args), 'rb') as file:
+            result.update(pickle.load(file))
+    script_args.shard_index, script_args.num_shards = 0, 1
+    with open(module.get_output_path(script_args), 'wb') as file:
+        pickle.dump(result, file)
+    return module.get_output_path(script_args)
+
+
+def main():
+    args, script_argv = parse_args()
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), args.script)
+    module = importlib.import_module(args.script[:-len(".py")])
+    script_args = module.parse_args(script_argv)
+    commands = [shard_command(script, script_argv, i, args.num_shards) for i in range(args.num_shards)]
+    if args.print_commands:
+        for command in commands:
+            print(subprocess.list2cmdline(command))
+        return
+    if not args.merge_only:
+        # every shard is an independent process, so the shards share nothing but the LLM backend
+        return_codes = parallel_map(lambda command: subprocess.run(command).returncode, commands,
+                                    args.workers or args.num_shards)
+        failed = [i for i, code in enumerate(return_codes) if code != 0]
+        if failed:
+            # finished questions are in the shards' checkpoints, so a rerun only redoes the rest
+            sys.exit(f"Shards {failed} failed, run again to resume them")
+    print(f"Results merged into {merge_shards(module, script_args, args.num_shards)}")
+
+
+if __name__ == '__main__':
+    main()
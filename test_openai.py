@@ -1,5 +1,7 @@
 import pickle
-from utils.chat2sql import execute_query
+from utils.execution import run_queries, set_heap_limit, latency_summary
+from utils.evaluation import extract_sql
+from utils.pipeline import get_output_path
 
 import argparse
 from llm.chatgpt import init_chatgpt, ask_llm
@@ -15,30 +17,44 @@ def parse_args():
                                                       LLM.GPT_35_TURBO_0613, LLM.GPT_35_TURBO_16K, 
                                                       LLM.GPT_4], default=LLM.GPT_35_TURBO)
     parser.add_argument("--output_folder", type=str, default=r'./dataset/')
+    parser.add_argument("--workers", type=int, default=8, help="Queries executed in parallel")
+    parser.add_argument("--timeout", type=float, default=5.0, help="Seconds a query may run before it is interrupted")
+    parser.add_argument("--max_rows", type=int, default=10000, help="Rows kept per query")
+    parser.add_argument("--heap_limit", type=int, default=1024, help="MB SQLite may allocate for all queries together, 0 for no limit")
+    parser.add_argument("--mode", type=str, choices=["staged", "fused"], default="staged", help="Mode of the run whose results are scored")
+    # results of a sharded run are scored after run_shards.py merged them
+    parser.set_defaults(shard_index=0, num_shards=1)
     return parser.parse_args()
 
+
 args = parse_args()
 
-with open(args.output_folder + 'output_' + args.model + '_' + args.question_file, 'rb') as file:
+with open(get_output_path(args, ".pkl"), 'rb') as file:
     sql_dic = pickle.load(file)
 
-correct_count = 0
-errors = []
-
-for database, queries in sql_dic.items():
-    sql = list(queries.values())[0][0]
-    try:
-        execute_query(database, sql)
-        correct_count += 1
-    except Exception as e:
-        errors.append([database, list(queries.items())[0], str(e)])
+if args.heap_limit:
+    set_heap_limit(args.heap_limit << 20)
+# every generated query of every database, run on a worker pool so no single query can stall the evaluation
+jobs = [(database, question, extract_sql(sql)) for database, queries in sql_dic.items() for question, sql in queries.items()]
+results = run_queries([(database, sql) for database, _, sql in jobs], args.workers, args.timeout, args.max_rows)
 
-total_queries = len(sql_dic)
-correct_rate = correct_count / total_queries * 100
+correct = []
+errors = []
+for (database, question, sql), result in zip(jobs, results):
+    if result["error"] is None:
+        correct.append([database, (question, sql), result["latency"]])
+    else:
+        errors.append([database, (question, sql), result["error"]])
+
+total_queries = len(jobs)
+correct_rate = len(correct) / total_queries * 100
 print(f"Correct rate: {correct_rate:.2f}%")
+print(f"Timeouts: {sum(result['error'] == 'timeout' for result in results)}, "
+      f"truncated results: {sum(result['truncated'] for result in results)}")
+print("Latency (ms): " + ", ".join(f"{key} {value:.1f}" for key, value in latency_summary(results).items()))
 
 with open('results/correct_' + args.model + '_' + args.question_file + '.pkl', 'wb') as correct_file:
-    pickle.dump(errors, correct_file) 
+    pickle.dump(correct, correct_file) 
 
 with open('results/errors_' + args.model + '_' + args.question_file + '.pkl', 'wb') as error_file:
     pickle.dump(errors, error_file) 
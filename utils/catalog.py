@@ -0,0 +1,158 @@
+import json
+import os
+import sqlite3
+import threading
+
+from utils.pool import get_pool
+from utils.profiling import profile_column
+from utils.utils import parse_db, get_table_names
+
+CATALOG_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE tables (db_id TEXT, table_name TEXT, position INTEGER, primary_key TEXT, foreign_key TEXT);
+CREATE TABLE columns (db_id TEXT, table_name TEXT, column_name TEXT, column_type TEXT, position INTEGER, n_values INTEGER);
+CREATE TABLE column_values (db_id TEXT, table_name TEXT, column_name TEXT, position INTEGER, value);
+CREATE TABLE column_profiles (db_id TEXT, table_name TEXT, column_name TEXT, profile TEXT);
+CREATE INDEX tables_idx ON tables (db_id, table_name COLLATE NOCASE);
+CREATE INDEX columns_idx ON columns (db_id, table_name COLLATE NOCASE, column_name COLLATE NOCASE);
+CREATE INDEX column_values_idx ON column_values (db_id, table_name COLLATE NOCASE, column_name COLLATE NOCASE, position);
+CREATE INDEX column_profiles_idx ON column_profiles (db_id, table_name COLLATE NOCASE, column_name COLLATE NOCASE);
+"""
+
+
+def crawl_database(db_id, db_path, max_values=50, with_profiles=True):
+    """Read tables, columns, keys, distinct value samples and column profiles of one database."""
+    with get_pool().connection(db_path=db_path) as connection:
+        return _crawl(db_id, db_path, connection.cursor(), max_values, with_profiles)
+
+
+def _crawl(db_id, db_path, cur, max_values, with_profiles):
+    table_info = parse_db(db_path, cur)
+
+    tables, columns, values, profiles = [], [], [], []
+    for position, table_name in enumerate(get_table_names(cur=cur)):
+        info = table_info.get(table_name, dict())
+        tables.append((db_id, table_name, position,
+                       json.dumps(info.get("primary_key", [])), json.dumps(info.get("foreign_key", []))))
+        for row in cur.execute(f'PRAGMA table_info("{table_name}")').fetchall():
+            column_name, column_type = row[1], row[2]
+            try:
+                column_values = [_[0] for _ in cur.execute(
+                    f'SELECT DISTINCT "{column_name}" FROM "{table_name}" LIMIT {max_values}')]
+            except sqlite3.Error as e:
+                print(f"Error reading {db_id}.{table_name}.{column_name}: {e}")
+                column_values = None
+            # n_values is NULL when the values could not be read, so lookups fall back to the source database
+            columns.append((db_id, table_name, column_name, column_type, row[0],
+                            None if column_values is None else len(column_values)))
+            for i, value in enumerate(column_values or []):
+                values.append((db_id, table_name, column_name, i, value))
+            if with_profiles and column_values is not None:
+                profile = profile_column(cur, table_name, column_name)
+                profiles.append((db_id, table_name, column_name, json.dumps(profile)))
+
+    return tables, columns, values, profiles
+
+
+def build_catalog(db_dir, save_path, max_values=50, with_profiles=True):
+    """Crawl every database under db_dir once and store the result in a single SQLite file."""
+    tmp_path = save_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    catalog = sqlite3.connect(tmp_path)
+    catalog.executescript(CATALOG_SCHEMA)
+    catalog.execute("INSERT INTO meta VALUES ('max_values', ?)", (str(max_values),))
+
+    for db_id in sorted(os.listdir(db_dir)):
+        db_path = os.path.join(db_dir, db_id, f"{db_id}.sqlite")
+        if not os.path.exists(db_path):
+            continue
+        try:
+            tables, columns, values, profiles = crawl_database(db_id, db_path, max_values, with_profiles)
+        except Exception as e:
+            print(f"Error processing {db_path}: {e}")
+            continue
+        catalog.executemany("INSERT INTO tables VALUES (?, ?, ?, ?, ?)", tables)
+        catalog.executemany("INSERT INTO columns VALUES (?, ?, ?, ?, ?, ?)", columns)
+        catalog.executemany("INSERT INTO column_values VALUES (?, ?, ?, ?, ?)", values)
+        catalog.executemany("INSERT INTO column_profiles VALUES (?, ?, ?, ?)", profiles)
+
+    catalog.commit()
+    catalog.close()
+    os.replace(tmp_path, save_path)
+
+
+class Catalog:
+    """Read-only view of a catalog file built by `build_catalog`.
+
+    Lookups return None when the catalog cannot answer them, so callers can fall back to the source database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.max_values = int(self._query("SELECT value FROM meta WHERE key = 'max_values'")[0][0])
+
+    def _query(self, query, params=()):
+        with self.lock:
+            return self.connection.execute(query, params).fetchall()
+
+    def get_db_ids(self):
+        return [_[0] for _ in self._query("SELECT DISTINCT db_id FROM tables ORDER BY db_id")]
+
+    def get_table_names(self, db_id):
+        return [_[0] for _ in self._query(
+            "SELECT table_name FROM tables WHERE db_id = ? ORDER BY position", (db_id,))]
+
+    def get_table_info(self, db_id):
+        """Primary and foreign keys per table, in the format of `parse_db`."""
+        rows = self._query(
+            "SELECT table_name, primary_key, foreign_key FROM tables WHERE db_id = ? ORDER BY position", (db_id,))
+        return {name: {"primary_key": json.loads(pks), "foreign_key": json.loads(fks)} for name, pks, fks in rows}
+
+    def get_columns(self, db_id, table):
+        if not self._query("SELECT 1 FROM tables WHERE db_id = ? AND table_name = ? COLLATE NOCASE", (db_id, table)):
+            return None
+        return [_[0] for _ in self._query(
+            "SELECT column_name FROM columns WHERE db_id = ? AND table_name = ? COLLATE NOCASE ORDER BY position",
+            (db_id, table))]
+
+    def get_column_types(self, db_id, table):
+        return {name: column_type for name, column_type in self._query(
+            "SELECT column_name, column_type FROM columns WHERE db_id = ? AND table_name = ? COLLATE NOCASE "
+            "ORDER BY position", (db_id, table))}
+
+    def get_unique_values(self, db_id, table, column, thr=5):
+        rows = self._query(
+            "SELECT n_values FROM columns WHERE db_id = ? AND table_name = ? COLLATE NOCASE "
+            "AND column_name = ? COLLATE NOCASE", (db_id, table, column))
+        if not rows or rows[0][0] is None:
+            return None
+        # a full sample may have been cut at max_values, so it cannot answer larger thresholds
+        if rows[0][0] >= self.max_values and thr > self.max_values:
+            return None
+        return [_[0] for _ in self._query(
+            "SELECT value FROM column_values WHERE db_id = ? AND table_name = ? COLLATE NOCASE "
+            "AND column_name = ? COLLATE NOCASE ORDER BY position LIMIT ?", (db_id, table, column, thr))]
+
+    def get_profile(self, db_id, table, column):
+        """Column statistics computed by `utils.profiling.profile_column`, or None if not profiled."""
+        try:
+            rows = self._query(
+                "SELECT profile FROM column_profiles WHERE db_id = ? AND table_name = ? COLLATE NOCASE "
+                "AND column_name = ? COLLATE NOCASE", (db_id, table, column))
+        except sqlite3.OperationalError:
+            # catalogs built before profiling have no profile table
+            return None
+        return json.loads(rows[0][0]) if rows else None
+
+    def iter_values(self):
+        """Yield (db_id, table, column, value) for every stored value sample."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT db_id, table_name, column_name, value FROM column_values ORDER BY rowid").fetchall()
+        yield from rows
+
+    def close(self):
+        self.connection.close()
@@ -1,48 +1,102 @@
 import sqlite3
-import os
-import ast
-import re
+from utils.catalog import Catalog
+from utils.value_index import ValueIndex
+from utils.pool import get_pool
+from utils.profiling import column_summary, representative_values
+from utils.parsing import parse_list
+
+# catalog built by build_catalog.py, used instead of the source databases when set
+_catalog = None
+
+# inverted value index built by build_catalog.py, used to pick the values a question mentions
+_value_index = None
+
+def init_catalog(path):
+    """Serve column and value lookups from a prebuilt catalog file."""
+    global _catalog
+    _catalog = Catalog(path)
+
+def init_value_index(path):
+    """Load the inverted value index used by `get_relevant_values`."""
+    global _value_index
+    _value_index = ValueIndex.load(path)
+
+def get_value_matches(database, question, tables=None):
+    """Values of the database mentioned by the question, as {table: {column: [values]}}."""
+    if _value_index is None:
+        return {}
+    return _value_index.match(database, question, tables)
 
 def get_db_path(database):
     """Generate the path for the SQLite database."""
-    return os.path.join('./dataset/spider/database', database, f"{database}.sqlite")
+    return get_pool().get_db_path(database)
 
-def execute_query(database, query):
+def execute_query(database, query, text_factory=None):
     """Execute a given SQL query on the specified database and return the result."""
-    db_path = get_db_path(database)
-    connection = sqlite3.connect(db_path)
-    cursor = connection.cursor()
-    cursor.execute(query)
-    result = cursor.fetchall()
-    connection.close()
-    return result
+    with get_pool().connection(database) as connection:
+        if text_factory is None:
+            return connection.execute(query).fetchall()
+        # the connection is borrowed for this block only, so its text factory can be switched for one query
+        connection.text_factory = text_factory
+        try:
+            return connection.execute(query).fetchall()
+        finally:
+            connection.text_factory = str
 
 def get_columns(database, table):
     """Retrieve column names of the specified table from the database."""
     # if database == 'hospital_1' and table == 'Procedure':
     #     print(table)
+    if _catalog is not None:
+        columns = _catalog.get_columns(database, table)
+        if columns is not None:
+            return columns
     query = f"PRAGMA table_info({table})"
     columns = execute_query(database, query)
     return [column[1] for column in columns]
 
 def get_unique_values(database, table, column, thr=5):
     """Retrieve unique values from the specified column of the table."""
-    column = f'"{column}"'  
-    query = f"SELECT DISTINCT {column} FROM {table}"
-    values = execute_query(database, query)
-    values = [item[0] for item in values]
-    if len(values) > thr:
-        return values[0:thr]
-    else:
-        return values
+    if _catalog is not None:
+        values = _catalog.get_unique_values(database, table, column, thr)
+        if values is not None:
+            return values
+    column = f'"{column}"'
+    # stop the scan after thr distinct values instead of materializing all of them
+    query = f"SELECT DISTINCT {column} FROM {table} LIMIT {thr}"
+    try:
+        values = execute_query(database, query)
+    except sqlite3.OperationalError as e:
+        if "decode" not in str(e):
+            raise
+        # text that is not valid UTF-8 is shown with its bad bytes replaced instead of failing the question
+        values = execute_query(database, query, lambda text: text.decode("utf-8", "replace"))
+    return [item[0] for item in values]
+
+def get_representative_values(database, table, column, thr=5):
+    """`column_summary` of the column from its catalog profile, e.g. frequent values or its range."""
+    if _catalog is not None:
+        profile = _catalog.get_profile(database, table, column)
+        if profile is not None:
+            summary = representative_values(profile, thr)
+            if not summary["values"] and summary["range"] is None:
+                # no value repeats, so a few stored values stand as examples
+                summary["values"] = get_unique_values(database, table, column, thr)
+            return summary
+    return column_summary(get_unique_values(database, table, column, thr))
     
+def get_relevant_values(database, table, column, matches=None, thr=5):
+    """`column_summary` of the column, its values starting with the ones the question mentions according to `get_value_matches`."""
+    table_matches = next((v for k, v in (matches or {}).items() if k.lower() == table.lower()), {})
+    matched = next((v for k, v in table_matches.items() if k.lower() == column.lower()), [])[0:thr]
+    if len(matched) == thr:
+        return column_summary(matched)
+    summary = get_representative_values(database, table, column, thr)
+    values = matched + [value for value in summary["values"] if value not in matched][0:thr - len(matched)]
+    return column_summary(values, summary["range"], summary["format"])
+
 def res_to_list(res):
-    """ Transform list-like string generated by LLM to list.   """
+    """ Transform list-like string generated by LLM to list, see `utils.parsing.parse_list`.   """
     if type(res) == list:
-        res = ast.literal_eval(res[0])
-        return res
-    else:
-        match = re.search(r"\[.*?\]", res)
-        content = match.group(0)
-        content_list = ast.literal_eval(content)
-        return content_list
+        res = res[0] if res else ""
+    return parse_list(res)
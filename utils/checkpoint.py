@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+
+
+def read_checkpoint(path):
+    """Answers in a checkpoint log as {(db_id, question): sql}, and the size of its intact lines in bytes."""
+    done, valid_size = {}, 0
+    with open(path, 'rb') as file:
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            done[(entry["db_id"], entry["question"])] = entry["sql"]
+            valid_size += len(line)
+    return done, valid_size
+
+
+class Checkpoint:
+    """Append-only JSONL log of answered questions, one {"db_id", "question", "sql"} line each.
+
+    Every answer is flushed as soon as it is written, so an interrupted run loses at most the
+    questions in flight, and a rerun with the same log skips what is already answered.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = {}
+        if os.path.exists(path):
+            self._load()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def _load(self):
+        self.done, valid_size = read_checkpoint(self.path)
+        if valid_size < os.path.getsize(self.path):
+            # drop a line cut short by a crash so new entries start on a clean line
+            with open(self.path, 'r+b') as file:
+                file.truncate(valid_size)
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def get(self, database, question):
+        return self.done.get((database, question))
+
+    def write(self, database, question, sql):
+        line = json.dumps({"db_id": database, "question": question, "sql": sql}, ensure_ascii=False)
+        with self.lock:
+            self.done[(database, question)] = sql
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def merge_checkpoints(paths):
+    """Answers of several checkpoint logs (e.g. from different machines) as {db_id: {question: sql}}."""
+    result = {}
+    for path in paths:
+        for (database, question), sql in read_checkpoint(path)[0].items():
+            result.setdefault(database, {})[question] = sql
+    return result
@@ -1,14 +1,20 @@
 import json
+import os
+import pickle
 import re
 import sqlite3
+import sys
 from copy import copy
 from pathlib import Path
 from typing import List, Dict
 
 import attr
-import torch
-import networkx as nx
-from tqdm import tqdm
+import numpy as np
+
+from utils.lazy import lazy_import
+
+# networkx is only needed for the foreign key graphs of load_tables
+nx = lazy_import("networkx")
 
 
 def build_foreign_key_map(entry):
@@ -90,6 +96,27 @@ class Schema:
     foreign_key_graph = attr.ib()
     orig = attr.ib()
     connection = attr.ib(default=None)
+    skeleton_vocabulary = attr.ib(default=None)
+
+
+@attr.s(frozen=True)
+class SkeletonVocabulary:
+    """Lower case names that sql2skeleton masks in queries on one database."""
+    tables = attr.ib()
+    columns = attr.ib()
+    table_dot_columns = attr.ib()
+
+
+def build_skeleton_vocabulary(schema_dict):
+    # every column is paired with every table, not only with its own, as sql2skeleton always did
+    table_names = list(schema_dict["table_names_original"])
+    column_names = [name.lower() for _, name in schema_dict["column_names_original"]]
+    table_dot_columns = set(name + ".*" for name in table_names)
+    table_dot_columns.update(table.lower() + "." + column for table in table_names for column in column_names)
+    return SkeletonVocabulary(
+        tables=frozenset(name.lower() for name in table_names),
+        columns=frozenset(["*"] + (column_names if table_names else [])),
+        table_dot_columns=frozenset(table_dot_columns))
 
 
 def postprocess_original_name(s: str):
@@ -160,8 +187,115 @@ def load_tables(paths):
 
             db_id = schema_dict['db_id']
             assert db_id not in schemas
-            schemas[db_id] = Schema(db_id, tables, columns, foreign_key_graph, schema_dict)
+            schemas[db_id] = Schema(db_id, tables, columns, foreign_key_graph, schema_dict,
+                                    skeleton_vocabulary=build_skeleton_vocabulary(schema_dict))
             # eval_foreign_key_maps[db_id] = build_foreign_key_map(schema_dict)
 
     return schemas, eval_foreign_key_maps
 
+
+
+@attr.s(slots=True, frozen=True)
+class CompactSchema:
+    """Array-backed schema of one database, a light counterpart of Schema for bulk processing.
+
+    Names are interned tuples indexed by table or column id, the table of every column and the
+    foreign keys are int32 arrays, and the foreign key graph is stored in CSR form: the
+    neighbours of table t are fk_targets[fk_offsets[t]:fk_offsets[t + 1]], joined on the
+    column pairs fk_edge_columns of the same slice.
+    """
+    db_id = attr.ib()
+    table_names = attr.ib()
+    table_names_original = attr.ib()
+    column_names = attr.ib()
+    column_names_original = attr.ib()
+    column_types = attr.ib()
+    column_tables = attr.ib()
+    primary_keys = attr.ib()
+    foreign_keys = attr.ib()
+    fk_offsets = attr.ib()
+    fk_targets = attr.ib()
+    fk_edge_columns = attr.ib()
+
+    def table_columns(self, table_id):
+        """Ids of the columns of a table."""
+        return np.flatnonzero(self.column_tables == table_id)
+
+    def neighbors(self, table_id):
+        """Ids of the tables a table shares a foreign key with."""
+        return self.fk_targets[self.fk_offsets[table_id]:self.fk_offsets[table_id + 1]]
+
+    def join_columns(self, source_table_id, dest_table_id):
+        """(source column id, dest column id) joining two adjacent tables, None if they are not."""
+        start, end = self.fk_offsets[source_table_id], self.fk_offsets[source_table_id + 1]
+        hits = np.flatnonzero(self.fk_targets[start:end] == dest_table_id)
+        if not len(hits):
+            return None
+        source, dest = self.fk_edge_columns[start + hits[0]]
+        return int(source), int(dest)
+
+
+def _intern(names):
+    return tuple(sys.intern(name) for name in names)
+
+
+def build_compact_schema(schema_dict):
+    column_tables = np.array([table_id for table_id, _ in schema_dict['column_names_original']], dtype=np.int32)
+    primary_keys = []
+    for column_id in schema_dict['primary_keys']:
+        primary_keys.extend(column_id if isinstance(column_id, list) else [column_id])
+    foreign_keys = np.array(schema_dict['foreign_keys'], dtype=np.int32).reshape(-1, 2)
+
+    # both directions of every foreign key, and like in load_tables' DiGraph the last key between two tables wins
+    edges = {}
+    for source_column_id, dest_column_id in foreign_keys.tolist():
+        source_table_id, dest_table_id = int(column_tables[source_column_id]), int(column_tables[dest_column_id])
+        edges[(source_table_id, dest_table_id)] = (source_column_id, dest_column_id)
+        edges[(dest_table_id, source_table_id)] = (dest_column_id, source_column_id)
+    n_tables = len(schema_dict['table_names_original'])
+    ordered = sorted(edges.items())
+    fk_offsets = np.zeros(n_tables + 1, dtype=np.int32)
+    np.add.at(fk_offsets, [source + 1 for (source, _), _ in ordered], 1)
+    return CompactSchema(
+        db_id=sys.intern(schema_dict['db_id']),
+        table_names=_intern(schema_dict['table_names']),
+        table_names_original=_intern(schema_dict['table_names_original']),
+        column_names=_intern(name for _, name in schema_dict['column_names']),
+        column_names_original=_intern(name for _, name in schema_dict['column_names_original']),
+        column_types=_intern(schema_dict['column_types']),
+        column_tables=column_tables,
+        primary_keys=np.array(primary_keys, dtype=np.int32),
+        foreign_keys=foreign_keys,
+        fk_offsets=np.cumsum(fk_offsets, dtype=np.int32),
+        fk_targets=np.array([dest for (_, dest), _ in ordered], dtype=np.int32),
+        fk_edge_columns=np.array([columns for _, columns in ordered], dtype=np.int32).reshape(-1, 2))
+
+
+def file_versions(paths):
+    """(path, size, modification time) of every file, which invalidate the caches built from them."""
+    return [(os.path.abspath(path), os.path.getsize(path), os.stat(path).st_mtime_ns) for path in paths]
+
+
+def load_compact_tables(paths, cache_path=""):
+    """{db_id: CompactSchema} of the tables.json files in paths.
+
+    The schemas are pickled to cache_path, and read back from it as long as the files in
+    paths keep their size and modification time.
+    """
+    versions = file_versions(paths)
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'rb') as file:
+            cached = pickle.load(file)
+        if cached["versions"] == versions:
+            return cached["schemas"]
+
+    schemas = {}
+    for path in paths:
+        with open(path) as file:
+            for schema_dict in json.load(file):
+                assert schema_dict['db_id'] not in schemas
+                schemas[schema_dict['db_id']] = build_compact_schema(schema_dict)
+    if cache_path:
+        with open(cache_path, 'wb') as file:
+            pickle.dump({"versions": versions, "schemas": schemas}, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return schemas
@@ -83,6 +83,19 @@ class LLM:
         GPT_4: 0.03
     }
 
+    # context window in tokens, shared by the prompt and the completion
+    context_windows = {
+        TEXT_DAVINCI_003: 4097,
+        CODE_DAVINCI_002: 8001,
+        GPT_35_TURBO: 4096,
+        GPT_35_TURBO_0613: 4096,
+        GPT_35_TURBO_16K: 16384,
+        GPT_35_TURBO_0301: 4096,
+        GPT_4: 8192
+    }
+    # ollama's default num_ctx, used for models not listed above
+    DEFAULT_CONTEXT_WINDOW = 2048
+
     # local LLMs
     LLAMA_7B = "llama-7b"
     ALPACA_7B = "alpaca-7b"
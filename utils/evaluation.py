@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from utils.execution import run_queries
+from utils.parsing import extract_sql as extract_query
+from utils.pool import get_pool
+from utils.utils import sql_normalization, sql2skeleton
+
+# errors that depend on the run (limits, load, the environment) rather than on the query and database
+TRANSIENT_ERRORS = ("timeout", "more than ", "MemoryError", "out of memory", "interrupted", "database is locked",
+                    "disk I/O error", "unable to open")
+# row hashes are added up modulo 2**128, so the digest of a result does not depend on the row order
+DIGEST_MODULUS = 1 << 128
+
+
+def normalize_value(value):
+    """Make values that SQL considers equal hash the same, e.g. 3 and 3.0."""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def result_digest(rows):
+    """Order-insensitive fingerprint of a result set, equal for the same multiset of rows."""
+    total = 0
+    for row in rows:
+        row_hash = hashlib.blake2b(repr(tuple(map(normalize_value, row))).encode("utf-8"), digest_size=16).digest()
+        total = (total + int.from_bytes(row_hash, "big")) % DIGEST_MODULUS
+    return f"{len(rows)}:{total:032x}"
+
+
+def load_gold(paths):
+    """Gold SQL of Spider's dev/train files as {(db_id, question): sql}."""
+    gold = {}
+    for path in paths:
+        with open(path) as file:
+            for entry in json.load(file):
+                gold[(entry["db_id"], entry["question"])] = entry["query"]
+    return gold
+
+
+def load_schemas(path):
+    """Spider's tables.json as {db_id: schema dict}, the format `sql2skeleton` expects."""
+    with open(path) as file:
+        return {schema["db_id"]: schema for schema in json.load(file)}
+
+
+def extract_sql(sql):
+    """The query in a stored answer: the first of a list of answers, see `utils.parsing.extract_sql`."""
+    if isinstance(sql, list):
+        sql = sql[0] if sql else ""
+    return extract_query(sql)
+
+
+class GoldCache:
+    """Digests of gold query results stored in a SQLite file, so every gold query runs only once.
+
+    Entries are keyed by database, query and the size and modification time of the database
+    file, so they are recomputed when a database changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS gold (db_id TEXT, sql TEXT, version TEXT, digest TEXT, error TEXT, "
+            "PRIMARY KEY (db_id, sql, version))")
+        self.connection.commit()
+
+    @staticmethod
+    def version(db_id):
+        stat = os.stat(get_pool().get_db_path(db_id))
+        return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+    def get(self, db_id, sql):
+        """Return (digest, error) for a cached gold query, or None on a miss."""
+        with self.lock:
+            return self.connection.execute("SELECT digest, error FROM gold WHERE db_id = ? AND sql = ? AND version = ?",
+                                           (db_id, sql, self.version(db_id))).fetchone()
+
+    def put_many(self, entries):
+        """Store (db_id, sql, digest, error) entries."""
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO gold VALUES (?, ?, ?, ?, ?)",
+                                        [(db_id, sql, self.version(db_id), digest, error)
+                                         for db_id, sql, digest, error in entries])
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def execute_digests(jobs, workers=8, timeout=30.0, max_rows=100000):
+    """(digest, error) of every (db_id, sql) job, a truncated result counts as an error."""
+    digests = []
+    for result in run_queries(jobs, workers, timeout, max_rows):
+        if result["error"] is not None:
+            digests.append((None, result["error"]))
+        elif result["truncated"]:
+            digests.append((None, f"more than {max_rows} rows"))
+        else:
+            digests.append((result_digest(result["rows"]), None))
+    return digests
+
+
+def is_transient(error):
+    return any(marker in error for marker in TRANSIENT_ERRORS)
+
+
+def gold_digests(jobs, cache=None, workers=8, timeout=30.0, max_rows=100000):
+    """(digest, error) of every gold (db_id, sql) job, running only the queries missing from cache."""
+    digests = {}
+    for job in set(jobs):
+        cached = cache.get(*job) if cache is not None else None
+        # caches written before transient errors were skipped may still hold some
+        if cached is not None and not (cached[1] and is_transient(cached[1])):
+            digests[job] = tuple(cached)
+    missing = [job for job in dict.fromkeys(jobs) if job not in digests]
+    computed = execute_digests(missing, workers, timeout, max_rows)
+    digests.update(zip(missing, computed))
+    if cache is not None and missing:
+        # a transient error would make the gold query unscorable until the database changes, so it runs again next time
+        cache.put_many([(db_id, sql, digest, error) for (db_id, sql), (digest, error) in zip(missing, computed)
+                        if error is None or not is_transient(error)])
+    return [digests[job] for job in jobs]
+
+
+def safe_match(function, predicted, gold, *args):
+    """Whether function maps both queries to the same form, False when either cannot be parsed."""
+    try:
+        return function(predicted, *args) == function(gold, *args)
+    except Exception:
+        return False
+
+
+def evaluate(answers, gold, schemas=None, cache=None, workers=8, timeout=30.0, max_rows=100000):
+    """Score the answers {db_id: {question: sql}} of a run against gold {(db_id, question): sql}.
+
+    A question counts for execution accuracy when the predicted and gold results are the same
+    multiset of rows, for exact match when `sql_normalization` maps both queries to the same text,
+    and for skeleton match when `sql2skeleton` does (needs the Spider schemas).
+    Questions without gold SQL are skipped.
+    """
+    jobs = [(db_id, question, extract_sql(sql), gold[(db_id, question)])
+            for db_id, questions in answers.items() for question, sql in questions.items()
+            if (db_id, question) in gold]
+    predicted = execute_digests([(db_id, sql) for db_id, _, sql, _ in jobs], workers, timeout, max_rows)
+    expected = gold_digests([(db_id, gold_sql) for db_id, _, _, gold_sql in jobs], cache, workers, timeout, max_rows)
+
+    records = []
+    for (db_id, question, sql, gold_sql), (digest, error), (gold_digest, gold_error) in zip(jobs, predicted, expected):
+        records.append({
+            "db_id": db_id,
+            "question": question,
+            "sql": sql,
+            "gold": gold_sql,
+            "execution": gold_error is None and error is None and digest == gold_digest,
+            "exact": safe_match(sql_normalization, sql, gold_sql),
+            "skeleton": schemas is not None and db_id in schemas
+                        and safe_match(sql2skeleton, sql, gold_sql, schemas.get(db_id)),
+            "error": error,
+            "gold_error": gold_error
+        })
+    return records
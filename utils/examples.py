@@ -0,0 +1,247 @@
+import json
+import os
+import pickle
+import random
+
+import numpy as np
+
+from utils.datasets.spider import file_versions
+from utils.enums import SELECTOR_TYPE
+from utils.retrieval import featurize, tokenize
+from utils.utils import sql2skeleton
+
+# selectors that rank the examples by question similarity first and filter by skeleton similarity
+SKELETON_SELECTORS = [
+    SELECTOR_TYPE.EUC_DISTANCE_SKELETON_SIMILARITY_THRESHOLD,
+    SELECTOR_TYPE.EUC_DISTANCE_PRE_SKELETON_SIMILARITY_THRESHOLD,
+    SELECTOR_TYPE.EUC_DISTANCE_PRE_SKELETON_SIMILARITY_PLUS,
+    SELECTOR_TYPE.EUC_DISTANCE_MASK_PRE_SKELETON_SIMILARITY_THRESHOLD,
+    SELECTOR_TYPE.EUC_DISTANCE_MASK_PRE_SKELETON_SIMILARITY_THRESHOLD_SHIFT,
+]
+MASK_SELECTORS = [
+    SELECTOR_TYPE.EUC_DISTANCE_QUESTION_MASK,
+    SELECTOR_TYPE.EUC_DISTANCE_MASK_PRE_SKELETON_SIMILARITY_THRESHOLD,
+    SELECTOR_TYPE.EUC_DISTANCE_MASK_PRE_SKELETON_SIMILARITY_THRESHOLD_SHIFT,
+]
+MASK_TOKEN = "<mask>"
+# step by which the SHIFT selector lowers the skeleton threshold until it has k examples
+THRESHOLD_SHIFT = 0.1
+
+
+def skeleton_tokens(skeleton):
+    """Tokens of a skeleton as `jaccard_similarity` splits them."""
+    return skeleton.strip().split(" ")
+
+
+def schema_words(db_schema):
+    """Lower case words of the table and column names of a Spider schema."""
+    names = db_schema["table_names_original"] + db_schema["table_names"] + \
+        [name for _, name in db_schema["column_names_original"] + db_schema["column_names"]]
+    return set(token for name in names for token in tokenize(name))
+
+
+def mask_question(question, words):
+    """Question words with the words of schema names replaced by a mask, so only its structure is compared."""
+    return [MASK_TOKEN if token in words else token for token in tokenize(question)]
+
+
+def load_examples(paths, tables_path, cache_path=""):
+    """Spider examples as dicts of db_id, question, query and skeleton.
+
+    Skeletons come from `sql2skeleton`, examples whose query it cannot parse are dropped. The
+    examples are pickled to cache_path, and read back from it as long as the files in paths and
+    tables_path keep their size and modification time.
+    """
+    versions = file_versions(list(paths) + [tables_path])
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'rb') as file:
+            cached = pickle.load(file)
+        # caches written before the versions were recorded are plain lists and are rebuilt
+        if isinstance(cached, dict) and cached.get("versions") == versions:
+            return cached["examples"]
+    with open(tables_path) as file:
+        schemas = {schema["db_id"]: schema for schema in json.load(file)}
+    examples = []
+    for path in paths:
+        with open(path) as file:
+            for entry in json.load(file):
+                try:
+                    skeleton = sql2skeleton(entry["query"], schemas[entry["db_id"]])
+                except Exception:
+                    continue
+                examples.append({
+                    "db_id": entry["db_id"],
+                    "question": entry["question"],
+                    "query": entry["query"],
+                    "skeleton": skeleton,
+                    "masked_question": mask_question(entry["question"], schema_words(schemas[entry["db_id"]]))
+                })
+    if cache_path:
+        with open(cache_path, 'wb') as file:
+            pickle.dump({"versions": versions, "examples": examples}, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return examples
+
+
+class SkeletonIndex:
+    """Token count matrix of SQL skeletons, scoring one skeleton against all of them at once.
+
+    Skeletons use a vocabulary of a few hundred SQL keywords, so the counts are stored dense and
+    column-major; a query skeleton only touches the columns of its own tokens.
+    """
+
+    def __init__(self, skeletons):
+        self.vocabulary = {}
+        rows = []
+        for skeleton in skeletons:
+            counts = {}
+            for token in skeleton_tokens(skeleton):
+                column = self.vocabulary.setdefault(token, len(self.vocabulary))
+                counts[column] = counts.get(column, 0) + 1
+            rows.append(counts)
+        self.counts = np.zeros((len(rows), len(self.vocabulary)), dtype=np.float32, order="F")
+        for row, counts in enumerate(rows):
+            self.counts[row, list(counts)] = list(counts.values())
+        self.lengths = self.counts.sum(axis=1)
+        self.norms = np.maximum(np.linalg.norm(self.counts, axis=1), 1e-12)
+
+    def encode(self, skeleton):
+        """Columns and counts of the known tokens of skeleton, and its total number of tokens."""
+        counts = {}
+        tokens = skeleton_tokens(skeleton)
+        for token in tokens:
+            if token in self.vocabulary:
+                column = self.vocabulary[token]
+                counts[column] = counts.get(column, 0) + 1
+        return np.fromiter(counts, dtype=np.intp), np.fromiter(counts.values(), dtype=np.float32), tokens
+
+    def jaccard(self, skeleton):
+        """`jaccard_similarity` of skeleton with every indexed skeleton."""
+        columns, counts, tokens = self.encode(skeleton)
+        intersection = np.minimum(self.counts[:, columns], counts).sum(axis=1)
+        return intersection / (self.lengths + len(tokens) - intersection)
+
+    def cosine(self, skeleton):
+        """Cosine similarity of the token counts of skeleton with every indexed skeleton."""
+        columns, counts, tokens = self.encode(skeleton)
+        # unknown tokens add to the norm of the query but to no dot product
+        norm = np.sqrt(np.sum(np.unique(tokens, return_counts=True)[1].astype(np.float32) ** 2))
+        return self.counts[:, columns] @ counts / (self.norms * max(norm, 1e-12))
+
+    def top_k(self, skeleton, k=5, metric="jaccard"):
+        """Indices and scores of the k most similar skeletons, best first."""
+        scores = self.jaccard(skeleton) if metric == "jaccard" else self.cosine(skeleton)
+        return top_k(scores, k)
+
+
+class QuestionIndex:
+    """TF-IDF weighted hashed word and trigram vectors of questions, stored as a sparse inverted index."""
+
+    def __init__(self, documents):
+        self.n_documents = len(documents)
+        features = [featurize(document) for document in documents]
+        postings = {}
+        for row, document in enumerate(features):
+            for feature, weight in document.items():
+                postings.setdefault(feature, []).append((row, weight))
+        self.idf = {feature: np.log((1 + self.n_documents) / (1 + len(rows))) + 1 for feature, rows in postings.items()}
+        norms = np.zeros(self.n_documents, dtype=np.float32)
+        for row, document in enumerate(features):
+            norms[row] = np.sqrt(sum((weight * self.idf[feature]) ** 2 for feature, weight in document.items()))
+        norms = np.maximum(norms, 1e-12)
+        self.postings = {}
+        for feature, entries in postings.items():
+            rows = np.array([row for row, _ in entries], dtype=np.intp)
+            weights = np.array([weight for _, weight in entries], dtype=np.float32) * self.idf[feature] / norms[rows]
+            self.postings[feature] = (rows, weights)
+
+    def cosine(self, tokens):
+        """Cosine similarity of the question tokens with every indexed question."""
+        query = {feature: weight * self.idf[feature] for feature, weight in featurize(tokens).items() if feature in self.idf}
+        scores = np.zeros(self.n_documents, dtype=np.float32)
+        if not query:
+            return scores
+        norm = np.sqrt(sum(weight ** 2 for weight in query.values()))
+        rows = np.concatenate([self.postings[feature][0] for feature in query])
+        weights = np.concatenate([self.postings[feature][1] * (weight / norm) for feature, weight in query.items()])
+        return np.bincount(rows, weights=weights, minlength=self.n_documents).astype(np.float32)
+
+
+def top_k(scores, k):
+    """Indices and scores of the k highest scores, best first and ties in index order."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp), scores[0:0]
+    candidates = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order], scores[candidates[order]]
+
+
+class ExampleSelector:
+    """Pick few-shot examples for a question from a pool of Spider examples.
+
+    The question is compared with the example questions (Euclidean distance of unit TF-IDF
+    vectors, which ranks like cosine similarity), with schema words masked for the MASK
+    selectors. EUC_DISTANCE_THRESHOLD keeps only the closest examples at a distance below
+    threshold, so it may return fewer than k. The skeleton selectors keep the closest examples
+    whose skeleton has a Jaccard similarity of at least threshold with the skeleton of the gold
+    query (SKELETON) or of a query predicted beforehand (PRE_SKELETON), and fill up with the
+    closest other examples.
+    """
+
+    def __init__(self, examples, selector_type=SELECTOR_TYPE.EUC_DISTANCE, threshold=0.85, seed=0):
+        self.examples = examples
+        self.selector_type = selector_type
+        self.threshold = threshold
+        self.random = random.Random(seed)
+        if selector_type in MASK_SELECTORS:
+            self.questions = QuestionIndex([example["masked_question"] for example in examples])
+        else:
+            self.questions = QuestionIndex([tokenize(example["question"]) for example in examples])
+        self.skeletons = SkeletonIndex([example["skeleton"] for example in examples])
+        self.db_ids = np.array([example["db_id"] for example in examples])
+
+    def question_scores(self, question, db_schema=None):
+        if self.selector_type in MASK_SELECTORS:
+            tokens = mask_question(question, schema_words(db_schema) if db_schema else set())
+        else:
+            tokens = tokenize(question)
+        return self.questions.cosine(tokens)
+
+    def select(self, question, k=5, db_schema=None, sql=None, exclude_db_id=None):
+        """Return the indices of the k selected examples.
+
+        sql is the gold or predicted query of the question, needed by the skeleton selectors
+        together with db_schema. Examples of exclude_db_id are never selected, e.g. to keep
+        examples of the evaluated database out of the prompt.
+        """
+        if self.selector_type == SELECTOR_TYPE.RANDOM:
+            candidates = [i for i, example in enumerate(self.examples) if example["db_id"] != exclude_db_id]
+            return self.random.sample(candidates, min(k, len(candidates)))
+
+        scores = self.question_scores(question, db_schema)
+        if exclude_db_id is not None:
+            scores[self.db_ids == exclude_db_id] = -np.inf
+        if self.selector_type == SELECTOR_TYPE.EUC_DISTANCE_THRESHOLD:
+            # the distance of unit vectors is sqrt(2 - 2 cos)
+            distances = np.sqrt(np.maximum(2 - 2 * scores, 0))
+            scores = np.where(distances < self.threshold, scores, -np.inf)
+        if self.selector_type not in SKELETON_SELECTORS or sql is None:
+            return [int(i) for i in top_k(scores, k)[0] if np.isfinite(scores[i])]
+
+        similarity = self.skeletons.jaccard(sql2skeleton(sql, db_schema))
+        if self.selector_type == SELECTOR_TYPE.EUC_DISTANCE_PRE_SKELETON_SIMILARITY_PLUS:
+            # both similarities lie in [0, 1] and count the same
+            return [int(i) for i in top_k(scores + similarity, k)[0] if np.isfinite(scores[i])]
+
+        threshold = self.threshold
+        selected = []
+        while True:
+            passing = np.where(similarity >= threshold, scores, -np.inf)
+            selected = [int(i) for i in top_k(passing, k)[0] if np.isfinite(passing[i])]
+            if len(selected) >= k or threshold <= 0 or \
+                    self.selector_type != SELECTOR_TYPE.EUC_DISTANCE_MASK_PRE_SKELETON_SIMILARITY_THRESHOLD_SHIFT:
+                break
+            threshold -= THRESHOLD_SHIFT
+        rest = np.where(similarity >= threshold, -np.inf, scores)
+        selected += [int(i) for i in top_k(rest, k - len(selected))[0] if np.isfinite(rest[i])]
+        return selected
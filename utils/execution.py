@@ -0,0 +1,66 @@
+import sqlite3
+import statistics
+import time
+
+from utils.parallel import parallel_map
+from utils.pool import get_pool
+
+# virtual machine instructions between two deadline checks
+PROGRESS_STEPS = 1000
+
+
+def set_heap_limit(n_bytes):
+    """Cap the memory SQLite may allocate in this process, queries that need more fail instead of swapping."""
+    # the limit is global to the SQLite library, so any connection can set it
+    connection = sqlite3.connect(":memory:")
+    connection.execute(f"PRAGMA hard_heap_limit = {int(n_bytes)}")
+    connection.close()
+
+
+def run_query(database, sql, timeout=5.0, max_rows=10000):
+    """Execute sql on database within timeout seconds and keep at most max_rows rows.
+
+    Returns a dict with the rows, whether they were truncated, the error message if the query
+    failed or timed out, and the wall-clock latency in seconds.
+    """
+    start = time.perf_counter()
+    deadline = start + timeout
+    result = {"database": database, "sql": sql, "rows": None, "truncated": False, "error": None}
+    with get_pool().connection(database) as connection:
+        # a non-zero return value makes SQLite abort the running statement with "interrupted"
+        connection.set_progress_handler(lambda: time.perf_counter() > deadline, PROGRESS_STEPS)
+        cursor = connection.cursor()
+        try:
+            cursor.execute(sql)
+            rows = cursor.fetchmany(max_rows + 1)
+            result["rows"] = rows[0:max_rows]
+            result["truncated"] = len(rows) > max_rows
+        except Exception as e:
+            result["error"] = "timeout" if time.perf_counter() > deadline else f"{type(e).__name__}: {e}"
+        finally:
+            cursor.close()
+            connection.set_progress_handler(None, 0)
+    result["latency"] = time.perf_counter() - start
+    return result
+
+
+def run_queries(jobs, workers=8, timeout=5.0, max_rows=10000):
+    """Run (database, sql) jobs on a thread pool and return their results in input order.
+
+    SQLite releases the GIL while it executes, so the queries run in parallel, and no query can
+    hold a worker for longer than timeout.
+    """
+    return parallel_map(lambda job: run_query(job[0], job[1], timeout, max_rows), jobs, workers)
+
+
+def latency_summary(results):
+    """Mean, median, 95th percentile and maximum latency of results, in milliseconds."""
+    latencies = sorted(result["latency"] * 1000 for result in results)
+    if not latencies:
+        return {}
+    return {
+        "mean": statistics.fmean(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "max": latencies[-1]
+    }
@@ -0,0 +1,60 @@
+import collections
+import json
+import threading
+
+from utils.chat2sql import execute_query, get_columns, get_relevant_values, get_value_matches
+from utils.retrieval import get_schema_index
+from utils.utils import filter_json
+
+# outcomes of fused answers, "fused" when the single call was used and otherwise why its reply was
+# rejected ("bad json", "no sql", "unknown table", "explain error", "request failed" or "prompt failed")
+stats = collections.Counter()
+_lock = threading.Lock()
+
+
+def count(outcome):
+    with _lock:
+        stats[outcome] += 1
+
+
+def candidate_columns(question, database, db, k=4):
+    """{table: {column: values}} of the k tables of db closest to the question, from the local schema index."""
+    candidates, _ = get_schema_index(database, db).related_tables(question, k, threshold=0, relative=0)
+    matches = get_value_matches(database, question)
+    return {table: {column: get_relevant_values(database, table, column, matches)
+                    for column in get_columns(database, table)}
+            for table, _ in candidates}
+
+
+def generate_fused_prompt(question, schema, joins=""):
+    """One prompt asking for the related tables, their columns and the SQL at once, answered as JSON."""
+    return (f"User's query is : {question} The following lines list the candidate tables as table(column: unique values).\n"
+            f"{schema}\n{joins}"
+            "Based on user's query, identify the related tables and columns and generate the proper SQL. "
+            "Reply a JSON object like {\"tables\": [\"table1\"], \"columns\": {\"table1\": [\"column1\"]}, "
+            "\"sql\": \"SELECT ...\"} without a semicolon at the end of the SQL. "
+            "Only return the JSON, do not reply any other texts.")
+
+
+def parse_fused(response, database, candidates):
+    """(SQL, None) of a valid fused response, or (None, why it is not valid).
+
+    Valid means JSON in the requested format, tables among the candidates, and SQL that
+    SQLite can compile against the database.
+    """
+    try:
+        answer = json.loads(filter_json(response))
+    except ValueError:
+        return None, "bad json"
+    if not isinstance(answer, dict) or not isinstance(answer.get("sql"), str) or "SELECT" not in answer["sql"].upper():
+        return None, "no sql"
+    known = {table.lower() for table in candidates}
+    if not isinstance(answer.get("tables"), list) or not all(str(table).lower() in known for table in answer["tables"]):
+        return None, "unknown table"
+    sql = answer["sql"].strip().rstrip(";")
+    try:
+        # EXPLAIN compiles the statement, so unknown tables or columns fail without running the query
+        execute_query(database, "EXPLAIN " + sql)
+    except Exception:
+        return None, "explain error"
+    return sql, None
@@ -0,0 +1,139 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+from utils.chat2sql import execute_query
+from utils.datasets.spider import build_compact_schema, load_compact_tables
+
+# schemas of tables.json loaded by init_join_paths, databases missing from it are read from SQLite
+_schemas = None
+_planners = {}
+_lock = threading.Lock()
+
+UNREACHABLE = np.iinfo(np.int16).max
+
+
+def init_join_paths(tables_path, cache_path=""):
+    """Plan joins on the foreign keys of a Spider tables.json instead of those declared in the databases."""
+    global _schemas
+    _schemas = load_compact_tables([tables_path], cache_path)
+
+
+def schema_from_database(database):
+    """CompactSchema of a SQLite database, from its declared tables, columns and foreign keys."""
+    tables = [row[0] for row in execute_query(
+        database, "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    column_names, column_ids, primary_keys, foreign_keys = [[-1, "*"]], {}, {}, []
+    for table_id, table in enumerate(tables):
+        for row in execute_query(database, f'PRAGMA table_info("{table}")'):
+            column_ids[(table.lower(), row[1].lower())] = len(column_names)
+            if row[5] == 1:
+                primary_keys[table.lower()] = row[1].lower()
+            column_names.append([table_id, row[1]])
+    for table in tables:
+        for row in execute_query(database, f'PRAGMA foreign_key_list("{table}")'):
+            source = column_ids.get((table.lower(), row[3].lower()))
+            # a key without target column references the primary key of the target table
+            target = row[4] or primary_keys.get(row[2].lower(), "")
+            dest = column_ids.get((row[2].lower(), target.lower()))
+            if source is not None and dest is not None:
+                foreign_keys.append([source, dest])
+    return build_compact_schema({
+        "db_id": database,
+        "table_names": tables,
+        "table_names_original": tables,
+        "column_names": column_names,
+        "column_names_original": column_names,
+        "column_types": ["text"] * len(column_names),
+        "primary_keys": [],
+        "foreign_keys": foreign_keys
+    })
+
+
+class JoinPlanner:
+    """Shortest join paths between the tables of one database over its foreign key graph.
+
+    The paths between all pairs of tables are computed once with a BFS from every table. The
+    tables of a query are connected with the greedy Steiner tree approximation of
+    Takahashi and Matsuyama: starting from one table, the table closest to the tree built so
+    far is attached along its shortest path, until all tables are in the tree.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        n_tables = len(schema.table_names_original)
+        self.table_ids = {name.lower(): i for i, name in enumerate(schema.table_names_original)}
+        self.distances = np.full((n_tables, n_tables), UNREACHABLE, dtype=np.int16)
+        # previous table on the shortest path from the row table to the column table
+        self.previous = np.full((n_tables, n_tables), -1, dtype=np.int32)
+        for source in range(n_tables):
+            self.distances[source, source] = 0
+            queue = deque([source])
+            while queue:
+                table = queue.popleft()
+                for neighbor in schema.neighbors(table):
+                    if self.distances[source, neighbor] == UNREACHABLE:
+                        self.distances[source, neighbor] = self.distances[source, table] + 1
+                        self.previous[source, neighbor] = table
+                        queue.append(neighbor)
+
+    def path(self, source, dest):
+        """Table ids on the shortest join path from source to dest, None if they are not connected."""
+        if self.distances[source, dest] == UNREACHABLE:
+            return None
+        path = [dest]
+        while path[-1] != source:
+            path.append(int(self.previous[source, path[-1]]))
+        return path[::-1]
+
+    def join_edges(self, table_ids):
+        """(table id, table id) pairs to join so that the given tables are connected, in join order.
+
+        Tables that no foreign key connects to the others are left out.
+        """
+        terminals = list(dict.fromkeys(table_ids))
+        if len(terminals) < 2:
+            return []
+        tree, edges = [terminals[0]], []
+        remaining = terminals[1:]
+        while remaining:
+            distances = self.distances[np.ix_(remaining, tree)]
+            terminal, node = np.unravel_index(np.argmin(distances), distances.shape)
+            if distances[terminal, node] == UNREACHABLE:
+                break
+            path = self.path(tree[node], remaining.pop(terminal))
+            for source, dest in zip(path, path[1:]):
+                if dest not in tree:
+                    tree.append(dest)
+                    edges.append((source, dest))
+        return edges
+
+    def join_conditions(self, tables):
+        """Join conditions like "singer.singer_id = concert.singer_id" connecting the named tables."""
+        table_ids = [self.table_ids[table.lower()] for table in tables if table.lower() in self.table_ids]
+        conditions = []
+        for source, dest in self.join_edges(table_ids):
+            source_column, dest_column = self.schema.join_columns(source, dest)
+            conditions.append(f"{self.schema.table_names_original[source]}.{self.schema.column_names_original[source_column]} = "
+                              f"{self.schema.table_names_original[dest]}.{self.schema.column_names_original[dest_column]}")
+        return conditions
+
+
+def get_join_planner(database):
+    """Build the planner of a database once and share it between threads."""
+    with _lock:
+        if database not in _planners:
+            if _schemas is not None and database in _schemas:
+                schema = _schemas[database]
+            else:
+                schema = schema_from_database(database)
+            _planners[database] = JoinPlanner(schema)
+        return _planners[database]
+
+
+def join_conditions(database, tables):
+    """Minimal join conditions connecting tables of database, [] when there is nothing to join."""
+    if len(tables) < 2:
+        return []
+    return get_join_planner(database).join_conditions(tables)
@@ -0,0 +1,25 @@
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that imports it on the first attribute access.
+
+    A missing package only raises its ImportError once a feature actually uses it.
+    """
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self.__name__), attr)
+
+
+def lazy_import(name):
+    """The module name if it is already imported, a LazyModule otherwise."""
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+def is_imported(name):
+    """Whether module name was actually imported, not only deferred."""
+    return name in sys.modules
@@ -0,0 +1,27 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+
+def parallel_map(func, items, concurrency=1):
+    """Apply func to every item with up to `concurrency` threads and return the results in input order."""
+    items = list(items)
+    if concurrency <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(items))) as executor:
+        # copy the caller's context so context variables follow the work into the threads
+        futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+        return [future.result() for future in futures]
+
+
+def assign_shards(weights, num_shards):
+    """Split the keys of weights into num_shards shards of about equal total weight, heaviest key first.
+
+    The split only depends on weights, so independent workers reading the same input agree on it.
+    """
+    loads = [0] * num_shards
+    shards = {}
+    for key in sorted(weights, key=lambda key: (-weights[key], str(key))):
+        shard = loads.index(min(loads))
+        shards[key] = shard
+        loads[shard] += weights[key]
+    return shards
@@ -0,0 +1,150 @@
+import ast
+import difflib
+import re
+
+# a fenced block of markdown, possibly still open at the end of a streamed reply
+_FENCE = re.compile(r"```[\w+-]*[ \t]*\n?(.*?)(?:```|$)", re.DOTALL)
+# upper case keywords come first, so a lower case "select" in the chatter does not start the query
+_SQL_START = re.compile(r"\b(SELECT|WITH)\b")
+_SQL_START_ANY_CASE = re.compile(r"\b(SELECT|WITH)\b", re.IGNORECASE)
+_QUOTES = "'\"`"
+# minimum difflib ratio for an answered name to stand for a real one
+NAME_CUTOFF = 0.8
+
+
+def strip_fences(text):
+    """The content of the first fenced code block of text, or text itself without one."""
+    match = _FENCE.search(text)
+    return match.group(1) if match else text
+
+
+def _scan(text, start, opening, closing):
+    """End of the bracket opened at start, skipping quoted text, or None while it is not closed."""
+    depth, quote = 0, None
+    i = start
+    while i < len(text):
+        char = text[i]
+        if quote:
+            if char == "\\":
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in _QUOTES:
+            quote = char
+        elif char == opening:
+            depth += 1
+        elif char == closing:
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return None
+
+
+def find_list(text):
+    """The first complete [...] of text, or None if it has none yet."""
+    start = text.find("[")
+    if start < 0:
+        return None
+    end = _scan(text, start, "[", "]")
+    return text[start:end] if end is not None else None
+
+
+def _split_items(text):
+    return [item.strip().strip(_QUOTES).strip() for item in re.split(r"[,\n]", text)]
+
+
+def parse_list(text):
+    """Items of the list an LLM replied, tolerating chatter, code fences and broken quoting.
+
+    The first bracketed list is evaluated as a Python literal, or split on commas when it is not
+    one. A reply without a complete list is split on commas and new lines.
+    """
+    text = strip_fences(text)
+    found = find_list(text)
+    if found is not None:
+        try:
+            items = ast.literal_eval(found)
+            if isinstance(items, (list, tuple)):
+                return [str(item).strip() for item in items if not isinstance(item, (list, tuple, dict))]
+        except (ValueError, SyntaxError):
+            pass
+        items = _split_items(found[1:-1])
+    else:
+        # a list cut off by the token limit keeps the items before the cut
+        items = _split_items(text[text.find("[") + 1:])
+    return [item for item in items if item]
+
+
+def _normalize(name):
+    return re.sub(r"[^0-9a-z]", "", name.lower())
+
+
+def match_names(items, names, cutoff=NAME_CUTOFF):
+    """The names of items, matched exactly, case-insensitively, ignoring punctuation or fuzzily.
+
+    "table.column" also matches column. Items that match no name are dropped, and every name is
+    returned once, in the order of items.
+    """
+    lower = {name.lower(): name for name in names}
+    normalized = {_normalize(name): name for name in names}
+    matched = []
+    for item in items:
+        candidates = [item] + ([item.rsplit(".", 1)[1]] if "." in item else [])
+        for candidate in candidates:
+            name = lower.get(candidate.lower()) or normalized.get(_normalize(candidate))
+            if name is None:
+                close = difflib.get_close_matches(candidate.lower(), list(lower), n=1, cutoff=cutoff)
+                name = lower[close[0]] if close else None
+            if name is not None:
+                if name not in matched:
+                    matched.append(name)
+                break
+    return matched
+
+
+def parse_names(text, names):
+    """The names among names that the list in an LLM reply refers to."""
+    return match_names(parse_list(text), names)
+
+
+def _statement_end(text, start):
+    """Position of the first ; after start outside quotes, or None."""
+    quote = None
+    for i in range(start, len(text)):
+        char = text[i]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in _QUOTES:
+            quote = char
+        elif char == ";":
+            return i
+    return None
+
+
+def _sql_start(text):
+    return _SQL_START.search(text) or _SQL_START_ANY_CASE.search(text)
+
+
+def extract_sql(text):
+    """The query in an LLM reply: from its first SELECT or WITH up to the ; that ends it, outside code fences."""
+    text = strip_fences(text)
+    match = _sql_start(text)
+    if match is None:
+        return text.strip()
+    end = _statement_end(text, match.start())
+    return text[match.start():end].strip()
+
+
+def list_complete(text):
+    """Whether a streamed reply already holds a complete list, so generation can stop."""
+    return find_list(strip_fences(text)) is not None
+
+
+def sql_complete(text):
+    """Whether a streamed reply already holds a query ended by ; or by the end of its code fence."""
+    match = _sql_start(text)
+    if match is None:
+        return False
+    return _statement_end(text, match.start()) is not None or text.count("```") >= 2
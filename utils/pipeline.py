@@ -0,0 +1,265 @@
+import collections
+import os
+import pickle
+
+from llm.cache import init_cache, get_cache
+from llm.rate_limit import queue_key
+from utils.chat2sql import init_catalog, init_value_index, get_columns, get_value_matches, get_relevant_values
+from utils.checkpoint import Checkpoint
+from utils.enums import SELECTOR_TYPE
+from utils.fused import candidate_columns, count, generate_fused_prompt, parse_fused
+from utils.join_paths import init_join_paths, join_conditions
+from utils.parallel import parallel_map, assign_shards
+from utils.parsing import extract_sql, list_complete, parse_names, sql_complete
+from utils.prompt import fit_prompt
+from utils.retrieval import get_schema_index
+
+
+def add_run_arguments(parser):
+    """Arguments shared by ask_llm.py and ask_ollama.py, the scripts add their model and client options."""
+    parser.add_argument("--question_folder", type=str,  default = './dataset/')
+    parser.add_argument("--question_file", type=str,  default = 'fuzzy_queries_1.pkl')
+    parser.add_argument("--start_index", type=int, default=0)
+    parser.add_argument("--end_index", type=int, default=1000000)
+    parser.add_argument("--temperature", type=float, default=0)
+    parser.add_argument("--mini_index_path", type=str, default="")
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--n", type=int, default=1, help="Size of self-consistent set")
+    parser.add_argument("--output_folder", type=str, default=r'./dataset/')
+    parser.add_argument("--cache_path", type=str, default=r'./dataset/llm_cache.sqlite', help="LLM response cache, empty to disable")
+    parser.add_argument("--cache_size", type=int, default=100000, help="Maximum number of cached responses")
+    parser.add_argument("--no_cache", action="store_true", help="Ignore cached responses but still store new ones")
+    parser.add_argument("--catalog_path", type=str, default=r'./dataset/catalog.sqlite', help="Catalog built by build_catalog.py, used when it exists")
+    parser.add_argument("--value_index_path", type=str, default=r'./dataset/value_index.pkl', help="Value index built by build_catalog.py, used when it exists")
+    parser.add_argument("--prefilter", type=str, choices=[SELECTOR_TYPE.COS_SIMILAR, SELECTOR_TYPE.EUC_DISTANCE], default=None,
+                        help="Answer step 1 from a local schema index when it is confident")
+    parser.add_argument("--prefilter_k", type=int, default=3, help="Maximum number of tables taken from the schema index")
+    parser.add_argument("--prefilter_threshold", type=float, default=0.3, help="Minimum best score to skip the LLM in step 1")
+    parser.add_argument("--concurrency", type=int, default=1, help="Number of questions processed in parallel")
+    parser.add_argument("--shard_index", type=int, default=0, help="Shard of the databases answered by this run, see run_shards.py")
+    parser.add_argument("--num_shards", type=int, default=1, help="Number of shards the databases are split into")
+    parser.add_argument("--checkpoint_path", type=str, default="", help="Log of answered questions to resume from, defaults to one per model, question file and index range")
+    parser.add_argument("--prompt_budget", type=int, default=None, help="Maximum tokens of the SQL prompt, defaults to what the model's context window allows")
+    parser.add_argument("--tables_path", type=str, default=r'./dataset/spider/tables.json', help="Spider schemas whose foreign keys plan the joins, used when it exists")
+    parser.add_argument("--tables_cache_path", type=str, default=r'./dataset/tables_cache.pkl', help="Binary cache of --tables_path, empty to disable")
+    parser.add_argument("--no_join_paths", action="store_true", help="Leave the join conditions out of the SQL prompt")
+    parser.add_argument("--mode", type=str, choices=["staged", "fused"], default="staged",
+                        help="fused asks for tables, columns and SQL in one call on locally retrieved tables, and runs the staged steps only when its answer is invalid")
+    parser.add_argument("--fused_tables", type=int, default=4, help="Candidate tables shown to the LLM in fused mode")
+    return parser
+
+def load_tables():
+    """Load valid tables from pickle file."""
+    with open("./dataset/valid_tables.pkl", 'rb') as file:
+        return pickle.load(file)
+
+def init_run(args):
+    """Initialize the caches and indexes a run uses, and return the valid tables."""
+    tables = load_tables()
+    if args.cache_path:
+        init_cache(args.cache_path, args.cache_size, bypass=args.no_cache)
+    if os.path.exists(args.catalog_path):
+        init_catalog(args.catalog_path)
+    if os.path.exists(args.value_index_path):
+        init_value_index(args.value_index_path)
+    if not args.no_join_paths and os.path.exists(args.tables_path):
+        init_join_paths(args.tables_path, args.tables_cache_path)
+    return tables
+
+def load_jobs(args, tables):
+    """(database, tables, question) of the questions this run answers."""
+    with open(args.question_folder + args.question_file, 'rb') as file:
+        question_file = pickle.load(file)
+    jobs = []
+    for database in question_file.keys():
+        db = tables[database]
+        questions = question_file[database]
+        questions = questions[0].split('\n')
+        jobs.extend((database, db, question) for question in questions)
+    if args.num_shards > 1:
+        # whole databases go to one shard, balanced by their number of questions
+        shards = assign_shards(collections.Counter(job[0] for job in jobs), args.num_shards)
+        jobs = [job for job in jobs if shards[job[0]] == args.shard_index]
+    # --start_index/--end_index select a slice of the questions, so a long run can be split across machines
+    return jobs[args.start_index:args.end_index]
+
+def shard_suffix(args):
+    return f"_shard{args.shard_index}of{args.num_shards}" if args.num_shards > 1 else ""
+
+def mode_suffix(args):
+    return "_fused" if args.mode == "fused" else ""
+
+def run_name(args):
+    # the suffixes go before the extension, so a fused run still writes a .pkl file
+    stem, extension = os.path.splitext(args.question_file)
+    return f"{args.model.replace(':','-')}_{stem}{mode_suffix(args)}{shard_suffix(args)}{extension}"
+
+def get_output_path(args, extension=""):
+    """Result file of a run, one per shard when the databases are sharded."""
+    return f"{args.output_folder}output_{run_name(args)}{extension}"
+
+def get_checkpoint_path(args):
+    """Default checkpoint log of a run, next to its output file."""
+    return f"{args.output_folder}checkpoint_{run_name(args)}_{args.start_index}-{args.end_index}.jsonl"
+
+def join_hint(joins):
+    """Line of the SQL prompt with the join conditions of the related tables, empty without joins."""
+    return f"Join the tables on {', '.join(joins)}.\n" if joins else ""
+
+def prefilter_tables(question, args, database, db):
+    """Get related tables from the local schema index, or None when it is not confident."""
+    if args.prefilter is None:
+        return None
+    candidates, confident = get_schema_index(database, db).related_tables(
+        question, args.prefilter_k, args.prefilter_threshold, selector_type=args.prefilter)
+    return [table for table, _ in candidates] if confident else None
+
+def index_tables(question, args, database, db):
+    """The tables of the local schema index closest to the question, however low they score."""
+    candidates, _ = get_schema_index(database, db).related_tables(
+        question, args.prefilter_k, threshold=0, selector_type=args.prefilter or SELECTOR_TYPE.COS_SIMILAR)
+    return [table for table, _ in candidates]
+
+
+class Pipeline:
+    """The steps of the framework on one LLM backend.
+
+    `ask(args, prompt, until=None)` returns the replies of the LLM to one prompt as a list, and
+    `generate_prompt` builds the prompts of the three steps in the wording that works for the
+    backend's models. An answer is the list of all generated queries when `keep_all` is set and
+    the first query otherwise, and result files end in `extension`, as the scripts have always
+    stored them.
+    """
+
+    def __init__(self, ask, generate_prompt, keep_all=True, extension=""):
+        self.ask = ask
+        self.generate_prompt = generate_prompt
+        self.keep_all = keep_all
+        self.extension = extension
+
+    def get_output_path(self, args):
+        return get_output_path(args, self.extension)
+
+    def get_related_tables(self, question, args, db, database):
+        """Get related tables from the schema index when it is confident, otherwise from LLM."""
+        related_tables = prefilter_tables(question, args, database, db)
+        if related_tables is not None:
+            return related_tables
+        prompt = self.generate_prompt(question, db, related_tables=True)
+        # generation stops at the end of the list, and its names are matched against the tables of db
+        related_tables = parse_names(self.ask(args, prompt, until=list_complete)[0], db)
+        # a reply naming none of the tables falls back to the schema index instead of losing the question
+        return related_tables or index_tables(question, args, database, db)
+
+    def get_related_columns(self, question, args, database, related_tables):
+        """Get related columns for each table, asking about all tables at the same time."""
+        # values the question mentions are shown before arbitrary samples
+        matches = get_value_matches(database, question)
+
+        def identify_columns(table):
+            columns = get_columns(database, table)
+            prompt = self.generate_prompt(question, database, columns=columns)
+            related_columns = parse_names(self.ask(args, prompt, until=list_complete)[0], columns) or columns
+            return {col: get_relevant_values(database, table, col, matches) for col in related_columns}
+
+        # the per-table requests are independent, so the step costs one round trip instead of one per table
+        columns_values = parallel_map(identify_columns, related_tables, len(related_tables))
+        return dict(zip(related_tables, columns_values))
+
+    def sql_prompt(self, question, args, related_columns_dic, database):
+        """Prompt of step 3, with the related columns compacted to fit the token budget of the model."""
+        # the join keys come from the foreign keys, so the LLM does not have to guess them
+        joins = join_conditions(database, list(related_columns_dic)) if not args.no_join_paths else None
+        return fit_prompt(lambda schema: self.generate_prompt(question, None, related_columns=schema, joins=joins),
+                          related_columns_dic, args.model, args.prompt_budget)
+
+    def answer(self, sqls):
+        return sqls if self.keep_all else sqls[0]
+
+    def generate_sql(self, question, args, related_columns_dic, database):
+        """Generate the SQL query from LLM."""
+        prompt = self.sql_prompt(question, args, related_columns_dic, database)
+        return self.answer([extract_sql(sql) for sql in self.ask(args, prompt, until=sql_complete)])
+
+    def answer_question(self, question, args, database, db):
+        """Run the three steps of the framework for one question, returning None on failure."""
+        # rate-limited requests are queued fairly across databases
+        queue_key.set(database)
+        try:
+            # Step 1: Get related tables
+            related_tables = self.get_related_tables(question, args, db, database)
+            # Step 2: Get related columns
+            related_columns_dic = self.get_related_columns(question, args, database, related_tables)
+            # Step 3: Generate SQL
+            return self.generate_sql(question, args, related_columns_dic, database)
+        except Exception as e:
+            print(f"Error occurs when executing on {database}: {type(e).__name__}: {e}")
+            return None
+
+    def answer_fused(self, question, args, database, db):
+        """Answer with one call on the tables the local schema index retrieves, running the staged steps when the answer is not valid."""
+        queue_key.set(database)
+        responses, reason = [], "prompt failed"
+        try:
+            candidates = candidate_columns(question, database, db, args.fused_tables)
+            joins = join_conditions(database, list(candidates)) if not args.no_join_paths else None
+            prompt = fit_prompt(lambda schema: generate_fused_prompt(question, schema, join_hint(joins)),
+                                candidates, args.model, args.prompt_budget)
+            reason = "request failed"
+            responses = self.ask(args, prompt)
+        except Exception:
+            # e.g. a broken database file, the staged steps report it and skip the question
+            pass
+        for response in responses:
+            sql, reason = parse_fused(response, database, candidates)
+            if sql is not None:
+                count("fused")
+                return self.answer([sql])
+        # the reason of the last reply, the staged steps answer instead
+        count(reason)
+        return self.answer_question(question, args, database, db)
+
+    def run(self, args, tables, jobs, answer_database=None):
+        """Answer the jobs not in the checkpoint yet and save the results of all jobs to the output path.
+
+        With answer_database(questions, args, database, db) the staged steps of a database are
+        answered together, so their prompts can be batched. It returns None for the questions it
+        failed to answer.
+        """
+        result = {}
+        answer = self.answer_fused if args.mode == "fused" else self.answer_question
+        checkpoint = Checkpoint(args.checkpoint_path or get_checkpoint_path(args))
+        todo = [job for job in jobs if (job[0], job[2]) not in checkpoint]
+        print(f"{len(jobs) - len(todo)} of {len(jobs)} questions already answered in {checkpoint.path}")
+        if answer_database is not None and args.mode == "staged":
+            # each step is batched over the questions of a database, so the databases are the parallel units
+            # failed questions and databases are not logged and are retried by the next run
+            def run_database(database):
+                questions = [question for db_id, _, question in todo if db_id == database]
+                try:
+                    sqls = answer_database(questions, args, database, tables[database])
+                except Exception as e:
+                    print(f"Error occurs when executing on {database}: {type(e).__name__}: {e}")
+                    return
+                for question, sql in zip(questions, sqls):
+                    if sql is not None:
+                        checkpoint.write(database, question, sql)
+            parallel_map(run_database, list(dict.fromkeys(job[0] for job in todo)), args.concurrency)
+        else:
+            # questions are independent, so they run in parallel and each answer is logged once it arrives,
+            # failed questions are not logged and are retried by the next run
+            def run_question(job):
+                sql = answer(job[2], args, job[0], job[1])
+                if sql is not None:
+                    checkpoint.write(job[0], job[2], sql)
+            parallel_map(run_question, todo, args.concurrency)
+        checkpoint.close()
+        for database, _, question in jobs:
+            result.setdefault(database, {})
+            if (database, question) in checkpoint:
+                result[database][question] = checkpoint.get(database, question)
+
+        if args.cache_path:
+            print(f"LLM cache: {get_cache().stats()}")
+        with open(self.get_output_path(args), 'wb') as file:
+            pickle.dump(result, file)
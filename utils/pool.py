@@ -0,0 +1,96 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+DATABASE_DIR = './dataset/spider/database'
+
+
+class ConnectionPool:
+    """Thread-safe pool of read-only SQLite connections keyed by database.
+
+    Idle connections are kept per database and the least recently used ones are closed
+    once more than `max_connections` handles are open.
+    """
+
+    def __init__(self, db_dir=DATABASE_DIR, max_connections=64, immutable=False):
+        self.db_dir = db_dir
+        self.max_connections = max_connections
+        self.immutable = immutable
+        self.lock = threading.Lock()
+        self.idle = OrderedDict()
+        self.n_open = 0
+
+    def get_db_path(self, db_id):
+        return os.path.join(self.db_dir, db_id, f"{db_id}.sqlite")
+
+    def _connect(self, db_path):
+        uri = Path(db_path).as_uri() + "?mode=ro"
+        if self.immutable:
+            # skips locking and change detection, only safe while nobody writes the file
+            uri += "&immutable=1"
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        connection.execute("PRAGMA query_only = ON")
+        return connection
+
+    @contextmanager
+    def connection(self, db_id=None, db_path=None):
+        """Borrow a connection to the database `db_id` (or the file `db_path`) for the duration of the block."""
+        key = os.path.abspath(db_path if db_path is not None else self.get_db_path(db_id))
+        connection = None
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                connection = idle.pop()
+                if not idle:
+                    del self.idle[key]
+            self.n_open += connection is None
+
+        if connection is None:
+            try:
+                connection = self._connect(key)
+            except Exception:
+                with self.lock:
+                    self.n_open -= 1
+                raise
+
+        try:
+            yield connection
+        finally:
+            with self.lock:
+                self.idle.setdefault(key, []).append(connection)
+                self.idle.move_to_end(key)
+                self._evict()
+
+    def _evict(self):
+        while self.n_open > self.max_connections and self.idle:
+            key, idle = next(iter(self.idle.items()))
+            idle.pop(0).close()
+            self.n_open -= 1
+            if not idle:
+                del self.idle[key]
+
+    def close(self):
+        with self.lock:
+            for idle in self.idle.values():
+                for connection in idle:
+                    connection.close()
+                    self.n_open -= 1
+            self.idle.clear()
+
+
+_pool = ConnectionPool()
+
+
+def init_pool(db_dir=DATABASE_DIR, max_connections=64, immutable=False):
+    """Replace the shared pool, e.g. to point it at another database directory."""
+    global _pool
+    _pool.close()
+    _pool = ConnectionPool(db_dir, max_connections, immutable)
+    return _pool
+
+
+def get_pool():
+    return _pool
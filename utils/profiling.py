@@ -0,0 +1,129 @@
+import hashlib
+import math
+import re
+from collections import Counter
+
+
+class HyperLogLog:
+    """Approximate distinct counter with 2**p one-byte registers (about 1.6% error for p=12)."""
+
+    def __init__(self, p=12):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        h = int.from_bytes(hashlib.blake2b(repr(value).encode("utf-8"), digest_size=8).digest(), "big")
+        index = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+
+class SpaceSaving:
+    """Top-k frequent items in bounded memory (Metwally et al.), counts are upper bounds.
+
+    The error of each count is the count of the item it replaced, so count - error is a lower bound.
+    """
+
+    def __init__(self, capacity=50):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+
+    def add(self, item):
+        if item in self.counts:
+            self.counts[item] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = 1
+            self.errors[item] = 0
+        else:
+            victim = min(self.counts, key=self.counts.get)
+            error = self.counts.pop(victim)
+            del self.errors[victim]
+            self.counts[item] = error + 1
+            self.errors[item] = error
+
+    def top(self, k):
+        return sorted(self.counts.items(), key=lambda item: -item[1])[:k]
+
+    def repeated(self, k):
+        """Up to k of the top items that certainly occurred more than once."""
+        return [item for item, count in self.top(k) if count - self.errors[item] >= 2]
+
+
+def format_pattern(value):
+    """Shape of a string value, e.g. "TX" -> "AA" and "2009-05-01" -> "9999-99-99"."""
+    pattern = re.sub(r"[A-Z]", "A", re.sub(r"[a-z]", "a", re.sub(r"[0-9]", "9", value)))
+    # collapse runs of lower case letters so words of different lengths share a pattern
+    return re.sub(r"a+", "a", pattern)[0:20]
+
+
+def profile_column(cursor, table, column, k=10):
+    """Stream a column once and summarize it: row and null counts, approximate distinct count,
+    top-k frequent values, numeric range and the most common string formats."""
+    hll = HyperLogLog()
+    frequent = SpaceSaving(capacity=max(50, 5 * k))
+    patterns = Counter()
+    n_rows, n_null, n_numeric = 0, 0, 0
+    minimum, maximum = None, None
+    for (value,) in cursor.execute(f'SELECT "{column}" FROM "{table}"'):
+        n_rows += 1
+        if value is None:
+            n_null += 1
+            continue
+        hll.add(value)
+        if isinstance(value, bytes):
+            continue
+        frequent.add(value)
+        if isinstance(value, (int, float)):
+            n_numeric += 1
+            minimum = value if minimum is None else min(minimum, value)
+            maximum = value if maximum is None else max(maximum, value)
+        else:
+            patterns[format_pattern(value)] += 1
+    return {
+        "n_rows": n_rows,
+        "n_null": n_null,
+        "distinct": hll.count(),
+        "top_values": frequent.top(k),
+        # in a long tail the top counts are mostly error, these are the values known to repeat
+        "repeated": frequent.repeated(k),
+        "numeric": n_numeric > 0 and n_numeric == n_rows - n_null,
+        "min": minimum,
+        "max": maximum,
+        "patterns": patterns.most_common(3)
+    }
+
+
+def column_summary(values, value_range=None, value_format=None):
+    """What a prompt shows for a column: real values, and the range and format of all values as hints."""
+    return {"values": list(values), "range": value_range, "format": value_format}
+
+
+def representative_values(profile, thr=5, low_cardinality=50):
+    """Pick what a prompt should show for a column from its profile, see `column_summary`.
+
+    Low-cardinality columns show their most frequent values, wide numeric columns their range,
+    and high-cardinality text columns the values that repeat plus their dominant format.
+    """
+    if profile["distinct"] <= low_cardinality:
+        return column_summary([value for value, _ in profile["top_values"]][0:thr])
+    if profile["numeric"]:
+        return column_summary([], (profile["min"], profile["max"]))
+    # catalogs built before "repeated" was profiled only have upper bounds, which are no evidence
+    values = profile.get("repeated", [])[0:thr]
+    n_text = profile["n_rows"] - profile["n_null"]
+    if profile["patterns"] and n_text and profile["patterns"][0][1] >= 0.9 * n_text:
+        return column_summary(values, value_format=profile["patterns"][0][0])
+    return column_summary(values)
@@ -0,0 +1,65 @@
+from utils.enums import LLM
+from utils.utils import count_tokens
+
+
+def format_value(value):
+    """Write a value the way SQL would, so text like 'TX' stays apart from numbers like 18."""
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
+def summary_values(summary):
+    """Values of a column in a columns dict, a plain list or a `profiling.column_summary`."""
+    return summary.get("values") or [] if isinstance(summary, dict) else list(summary or [])
+
+
+def format_column(column, summary, max_values=None):
+    """column: value | value, followed by the range and format of the column as unquoted hints."""
+    parts = []
+    values = summary_values(summary)[0:max_values]
+    if values:
+        parts.append(" | ".join(map(format_value, values)))
+    if isinstance(summary, dict) and max_values != 0:
+        if summary.get("range") is not None:
+            parts.append(f"(range {summary['range'][0]} to {summary['range'][1]})")
+        if summary.get("format"):
+            parts.append(f"(format {summary['format']})")
+    return f"{column}: " + " ".join(parts) if parts else column
+
+
+def serialize_schema(columns_dic, max_values=None):
+    """One line per table as table(column: value | value, column, ...), far shorter than the dict repr."""
+    lines = []
+    for table, columns in columns_dic.items():
+        parts = [format_column(column, summary, max_values) for column, summary in columns.items()]
+        lines.append(f"{table}({', '.join(parts)})")
+    return "\n".join(lines)
+
+
+def prompt_budget(model, max_tokens=200):
+    """Tokens left for the prompt of model once the completion is reserved."""
+    return LLM.context_windows.get(model, LLM.DEFAULT_CONTEXT_WINDOW) - max_tokens
+
+
+def fit_schema(columns_dic, budget, tokenizer_type=None):
+    """Serialize columns_dic in at most budget tokens.
+
+    Values are listed most relevant first (see `chat2sql.get_relevant_values`), so the values per
+    column are cut from the end until the text fits, down to the column names alone.
+    """
+    # hints count as one value, so they are only dropped with the values
+    longest = max((max(len(summary_values(summary)), 1) for columns in columns_dic.values()
+                   for summary in columns.values() if summary), default=0)
+    for max_values in range(longest, -1, -1):
+        text = serialize_schema(columns_dic, max_values)
+        if count_tokens(text, tokenizer_type) <= budget:
+            break
+    return text
+
+
+def fit_prompt(make_prompt, columns_dic, model, budget=None):
+    """Build make_prompt(schema) with the schema compacted so the whole prompt fits the budget of model."""
+    budget = min(budget or prompt_budget(model), prompt_budget(model))
+    overhead = count_tokens(make_prompt(""), model)
+    return make_prompt(fit_schema(columns_dic, budget - overhead, model))
@@ -0,0 +1,105 @@
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from utils.chat2sql import get_columns, get_unique_values
+from utils.enums import SELECTOR_TYPE
+from utils.value_index import STOPWORDS
+
+N_FEATURES = 1 << 14
+
+
+def tokenize(text):
+    """Split names like "FacultyParticipatesIn" or "name_full" and free text into lower case words."""
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", str(text))
+    return [token for token in re.findall(r"[a-z0-9]+", text.lower()) if token not in STOPWORDS]
+
+
+def featurize(tokens, weight=1.0, features=None):
+    """Add hashed word and character trigram features of tokens to a sparse feature dict."""
+    features = {} if features is None else features
+    for token in tokens:
+        grams = [token] + [token[i:i + 3] for i in range(len(token) - 2)] if len(token) > 3 else [token]
+        for gram in grams:
+            index = zlib.crc32(gram.encode("utf-8")) % N_FEATURES
+            features[index] = features.get(index, 0.0) + weight
+    return features
+
+
+class SchemaIndex:
+    """Vector index over the tables of one database for retrieving the tables a question is about.
+
+    Every table is embedded from its name, its column names and sampled column values with
+    TF-IDF weighted hashed word and character trigram features.
+    """
+
+    def __init__(self, database, tables, n_values=5):
+        self.database = database
+        self.tables = list(tables)
+        self.columns = {}
+        documents = []
+        for table in self.tables:
+            columns = get_columns(database, table)
+            self.columns[table] = columns
+            features = featurize(tokenize(table), weight=3.0)
+            for column in columns:
+                featurize(tokenize(column), weight=2.0, features=features)
+                values = get_unique_values(database, table, column, n_values)
+                featurize([token for value in values if isinstance(value, str) for token in tokenize(value)],
+                          features=features)
+            documents.append(features)
+
+        self.matrix = np.zeros((len(documents), N_FEATURES), dtype=np.float32)
+        for row, features in enumerate(documents):
+            self.matrix[row, list(features)] = list(features.values())
+        # features shared by every table say nothing about which table a question needs
+        df = np.count_nonzero(self.matrix, axis=0)
+        self.idf = np.log((1 + len(documents)) / (1 + df)).astype(np.float32) + 1
+        self.matrix = self._normalize(self.matrix * self.idf)
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def embed(self, question):
+        features = featurize(tokenize(question))
+        vector = np.zeros(N_FEATURES, dtype=np.float32)
+        vector[list(features)] = list(features.values())
+        return self._normalize(vector * self.idf)
+
+    def scores(self, question, selector_type=SELECTOR_TYPE.COS_SIMILAR):
+        """Similarity of the question to every table, higher is closer."""
+        vector = self.embed(question)
+        if selector_type == SELECTOR_TYPE.EUC_DISTANCE:
+            # distance between unit vectors lies in [0, 2]
+            return 1 - np.linalg.norm(self.matrix - vector, axis=1) / 2
+        return self.matrix @ vector
+
+    def related_tables(self, question, k=3, threshold=0.3, relative=0.6, selector_type=SELECTOR_TYPE.COS_SIMILAR):
+        """Return up to k candidate tables with their scores, and whether the best match clears threshold.
+
+        Candidates are the tables scoring at least `relative` times the best score.
+        """
+        if not self.tables:
+            return [], False
+        scores = self.scores(question, selector_type)
+        ranked = np.argsort(-scores, kind="stable")[:k]
+        best = float(scores[ranked[0]])
+        candidates = [(self.tables[i], float(scores[i])) for i in ranked if scores[i] >= best * relative]
+        return candidates, best >= threshold
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_schema_index(database, tables):
+    """Build the index of a database once and share it between threads."""
+    key = (database, tuple(tables))
+    with _lock:
+        if key not in _indexes:
+            _indexes[key] = SchemaIndex(database, tables)
+        return _indexes[key]
@@ -0,0 +1,241 @@
+import re
+
+from sql_metadata import Parser
+from sql_metadata.keywords_lists import RELEVANT_KEYWORDS, SUBQUERY_PRECEDING_KEYWORDS, TABLE_ADJUSTMENT_KEYWORDS
+from sqlparse import keywords, tokens as T
+from sqlparse.lexer import Lexer
+from sqlparse.sql import Statement, Token
+
+# grouping of deeper or longer statements fails in sqlparse, those take the reference path
+MAX_DEPTH = 50
+MAX_TOKENS = 5000
+# keywords that make sql_metadata track the last keyword in ways _simple_aliases does not follow
+_BAIL_KEYWORDS = {"WITH", "INTO", "UPDATE", "TABLE", "IFNOTEXISTS", "EXTRACT", "OVER", "USING", "WINDOW"}
+
+
+def _compile():
+    """Join the lexer rules of sqlparse into one regex, tried in the same order as sqlparse tries them.
+
+    Returns None when sqlparse or sql_metadata lack the internals this relies on, which were
+    checked against sqlparse 0.5.5 and sql_metadata 2.20.0 (`Lexer.get_default_instance` only
+    exists from sqlparse 0.4.4 on); every query then goes through `sql_metadata.Parser`.
+    """
+    try:
+        lexer = Lexer.get_default_instance()
+        process_as_keyword = keywords.PROCESS_AS_KEYWORD
+        rules = [(rexmatch.__self__.pattern, action) for rexmatch, action in lexer._SQL_REGEX]
+    except AttributeError:
+        return None
+    if not callable(getattr(Parser, "_parse", None)):
+        return None
+    parts, actions = [], {}
+    for i, (pattern, action) in enumerate(rules):
+        if "\\1" in pattern:
+            # a back reference must be named once the rules share one pattern
+            pattern = pattern.replace("(", f"(?P<r{i}>", 1).replace("\\1", f"(?P=r{i})")
+        parts.append(f"(?P<g{i}>{pattern})")
+        actions[f"g{i}"] = action
+    try:
+        regex = re.compile("|".join(parts), re.IGNORECASE | re.UNICODE)
+    except re.error:
+        return None
+    return regex, actions, lexer, process_as_keyword
+
+
+_COMPILED = _compile()
+# whether queries can take the fast path, False on sqlparse or sql_metadata versions it does not support
+FAST_PATH = _COMPILED is not None
+_REGEX, _ACTIONS, _LEXER, _PROCESS_AS_KEYWORD = _COMPILED or (None, None, None, None)
+_keyword_types = {}
+
+
+def tokenize(sql):
+    """The (ttype, value) stream of `sqlparse.lexer.tokenize`, matching all rules in one regex call per token."""
+    stream = []
+    pos, end = 0, len(sql)
+    while pos < end:
+        m = _REGEX.match(sql, pos)
+        if m is None:
+            stream.append((T.Error, sql[pos]))
+            pos += 1
+            continue
+        value = m.group()
+        action = _ACTIONS[m.lastgroup]
+        if action is _PROCESS_AS_KEYWORD:
+            ttype = _keyword_types.get(value)
+            if ttype is None:
+                ttype = _keyword_types[value] = _LEXER.is_keyword(value)[0]
+            stream.append((ttype, value))
+        else:
+            stream.append((action, value))
+        pos = m.end()
+    return stream
+
+
+def _flat_tokens(sql):
+    """Non-whitespace tokens of sql if sql_metadata sees the same tokens without sqlparse's grouping pass,
+    None otherwise.
+
+    That holds for single SELECT statements without comments, where grouping does not merge or
+    retype any token that sql_metadata looks at.
+    """
+    stream = tokenize(sql)
+    if len(stream) > MAX_TOKENS:
+        return None
+    tokens = []
+    depth = 0
+    previous = None
+    for ttype, value in stream:
+        if ttype in T.Whitespace:
+            previous = None
+            continue
+        if ttype is T.Error or ttype in T.Comment:
+            return None
+        if ttype is T.Punctuation:
+            if value == ";":
+                # sqlparse would split the statement here
+                return None
+            depth += (value == "(") - (value == ")")
+            if depth > MAX_DEPTH:
+                return None
+        elif ttype is T.Keyword and value.split()[0] == "GO":
+            return None
+        elif ttype is T.Name and previous is T.Number.Integer:
+            # sqlparse groups names starting with digits, which sql_metadata merges back
+            return None
+        tokens.append((ttype, value))
+        previous = ttype
+    if not tokens or tokens[0][1].upper() != "SELECT":
+        return None
+    return tokens
+
+
+def _merged_tokens(tokens):
+    """(ttype, value) of the tokens of sql_metadata's `Parser.tokens`, with dotted names merged into one token."""
+    def is_part(index):
+        ttype, value = tokens[index]
+        if ttype in T.Keyword:
+            return False
+        return value == "." or (index + 1 < len(tokens) and tokens[index + 1][1] == ".")
+
+    merged = []
+    combine = False
+    for index, (ttype, value) in enumerate(tokens):
+        if is_part(index):
+            combine = True
+            continue
+        value = value.strip("`").strip('"')
+        if combine:
+            position = index
+            while position > 1 and is_part(position - 1):
+                value = tokens[position - 1][1].strip("`") + value
+                position -= 1
+            combine = False
+        merged.append((ttype, value))
+    return merged
+
+
+def _token_values(tokens):
+    """Values of the tokens of sql_metadata's `Parser.tokens`."""
+    return [value for _, value in _merged_tokens(tokens)]
+
+
+def _is_keyword(ttype):
+    return ttype in T.Keyword or (ttype.parent is T.Name and ttype is not T.Name)
+
+
+def _normalized(value):
+    return "".join(value.split()).upper()
+
+
+def _simple_aliases(tokens, keys):
+    """The aliases among keys that sql_metadata finds in tokens, None if the query needs the full parser.
+
+    Follows `Parser.tables_aliases` for queries without subqueries in FROM clauses, WITH blocks or
+    the other constructs that change how the parser tracks keywords, where a name is a table
+    exactly when it directly follows FROM, a JOIN or a comma of a FROM clause.
+    """
+    merged = _merged_tokens(tokens)
+    normalized = [_normalized(value) for _, value in merged]
+    keyword = [_is_keyword(ttype) for ttype, _ in merged]
+    last_keywords = []
+    last_keyword = ""
+    for index, (ttype, value) in enumerate(merged):
+        last_keywords.append(last_keyword)
+        if normalized[index] in _BAIL_KEYWORDS:
+            return None
+        if value == "(" and index > 0 and normalized[index - 1] in SUBQUERY_PRECEDING_KEYWORDS:
+            return None
+        if value == "," and last_keyword == "ON":
+            last_keyword = "FROM"
+        elif keyword[index] and normalized[index] in RELEVANT_KEYWORDS:
+            last_keyword = normalized[index]
+
+    def is_table(index):
+        # see SQLToken.is_potential_table_name and is_alias_of_table_or_alias_of_subquery
+        if index < 1 or last_keywords[index] not in TABLE_ADJUSTMENT_KEYWORDS:
+            return False
+        ttype, previous = merged[index - 1]
+        return ((merged[index][0] is T.Name or keyword[index])
+                and normalized[index - 1] not in ("AS", "WITH")
+                and normalized[index] not in ("AS", "SELECT", "IF", "SET", "WITH", "IFNOTEXISTS")
+                and (normalized[index - 1] == last_keywords[index] or (ttype is T.Punctuation and previous != ")")))
+
+    aliases = {}
+    for index, (ttype, value) in enumerate(merged):
+        if value not in keys or last_keywords[index] not in TABLE_ADJUSTMENT_KEYWORDS:
+            continue
+        if not (ttype is T.Name or (keyword[index] and normalized[index] != "AS")) or is_table(index):
+            continue
+        if index + 1 < len(merged) and keyword[index + 1] and normalized[index + 1] == "AS":
+            continue
+        table = index - 2 if keyword[index - 1] and normalized[index - 1] == "AS" else index - 1
+        if table < 0:
+            continue
+        if not is_table(table):
+            if merged[table][0] is T.Name or keyword[table]:
+                # the name may still be a table elsewhere in the query
+                return None
+            continue
+        aliases[value] = merged[table][1]
+    return aliases
+
+
+class _FlatParser(Parser):
+    """sql_metadata parser fed with already lexed, ungrouped tokens."""
+
+    def __init__(self, sql, tokens):
+        super().__init__(sql)
+        self._flat = tokens
+
+    def _parse(self, sql):
+        return (Statement([Token(ttype, value) for ttype, value in self._flat]),)
+
+
+def token_values(sql):
+    """Values of `sql_metadata.Parser(sql).tokens`."""
+    tokens = _flat_tokens(sql) if FAST_PATH and '"' not in sql else None
+    if tokens is None:
+        return [token.value for token in Parser(sql).tokens]
+    return _token_values(tokens)
+
+
+def tables_aliases(sql, keys=None):
+    """`sql_metadata.Parser(sql).tables_aliases`, restricted to keys when given.
+
+    Returns {} without parsing when none of the keys occurs as a token of sql.
+    """
+    tokens = _flat_tokens(sql) if FAST_PATH and '"' not in sql else None
+    if tokens is None:
+        aliases = Parser(sql).tables_aliases
+    else:
+        values = set(_token_values(tokens))
+        # a WITH block may make the parser reject the query, so that case is always parsed
+        if keys is not None and not set(keys) & values and not any(value.upper() == "WITH" for value in values):
+            return {}
+        aliases = _simple_aliases(tokens, set(keys)) if keys is not None else None
+        if aliases is None:
+            aliases = _FlatParser(sql, tokens).tables_aliases
+    if keys is None:
+        return aliases
+    return {key: value for key, value in aliases.items() if key in keys}
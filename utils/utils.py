@@ -1,12 +1,17 @@
 import collections
+import functools
 import json
 import os
 import re
-import sqlite3
 
-from transformers import AutoTokenizer
+from utils.datasets.spider import build_skeleton_vocabulary
 from utils.enums import LLM
-from sql_metadata import Parser
+from utils.lazy import lazy_import
+from utils.sql_lexer import token_values, tables_aliases as tables_aliases_of
+from utils.pool import get_pool
+
+# loading transformers takes seconds, and only tokenizers of local checkpoints need it
+transformers = lazy_import("transformers")
 
 
 class SqliteTable(dict):
@@ -18,35 +23,35 @@ def get_tables(path_db):
     if not os.path.exists(path_db):
         raise RuntimeError(f"{path_db} not exists")
 
-    # init sqlite connection
-    connection = sqlite3.connect(path_db)
-    cur = connection.cursor()
+    # borrow a pooled sqlite connection
+    with get_pool().connection(db_path=path_db) as connection:
+        cur = connection.cursor()
 
-    # extract table information
-    table_info = parse_db(path_db, cur)
-    # TODO: ! add here
-    table_names = get_table_names(cur=cur)
+        # extract table information
+        table_info = parse_db(path_db, cur)
+        # TODO: ! add here
+        table_names = get_table_names(cur=cur)
 
-    res = list()
-    for table_name in table_names:
-        # schema
-        schema = [_[1] for _ in cur.execute(f'PRAGMA table_info("{table_name}")')]
-
-        # data
-        data = None
-        # data = cur.execute(f"SELECT * FROM {table_name} LIMIT 5").fetchall()
-
-        # append table
-        res.append(
-            SqliteTable(
-                name=table_name,
-                schema=schema,
-                data=data,
-                table_info=table_info.get(table_name, dict())
+        res = list()
+        for table_name in table_names:
+            # schema
+            schema = [_[1] for _ in cur.execute(f'PRAGMA table_info("{table_name}")')]
+
+            # data
+            data = None
+            # data = cur.execute(f"SELECT * FROM {table_name} LIMIT 5").fetchall()
+
+            # append table
+            res.append(
+                SqliteTable(
+                    name=table_name,
+                    schema=schema,
+                    data=data,
+                    table_info=table_info.get(table_name, dict())
+                )
             )
-        )
 
-    cur.close()
+        cur.close()
     return res
 
 
@@ -76,11 +81,10 @@ def execute_query(queries, path_db=None, cur=None):
     """
     assert not (path_db is None and cur is None), "path_db and cur cannot be NoneType at the same time"
 
-    close_in_func = False
+    # borrow a pooled connection if needed
     if cur is None:
-        con = sqlite3.connect(path_db)
-        cur = con.cursor()
-        close_in_func = True
+        with get_pool().connection(db_path=path_db) as con:
+            return execute_query(queries, cur=con.cursor())
 
     if isinstance(queries, str):
         results = cur.execute(queries).fetchall()
@@ -92,10 +96,6 @@ def execute_query(queries, path_db=None, cur=None):
     else:
         raise TypeError(f"queries cannot be {type(queries)}")
 
-    # close the connection if needed
-    if close_in_func:
-        con.close()
-
     return results
 
 def format_foreign_key(table_name: str, res: list):
@@ -149,11 +149,9 @@ def cost_estimate(n_tokens: int, model):
 
 
 def get_sql_for_database(path_db=None, cur=None):
-    close_in_func = False
     if cur is None:
-        con = sqlite3.connect(path_db)
-        cur = con.cursor()
-        close_in_func = True
+        with get_pool().connection(db_path=path_db) as con:
+            return get_sql_for_database(path_db, con.cursor())
 
     table_names = get_table_names(path_db, cur)
 
@@ -161,52 +159,56 @@ def get_sql_for_database(path_db=None, cur=None):
 
     sqls = execute_query(queries, path_db, cur)
 
-    if close_in_func:
-        cur.close()
-
     return [_[0][0] for _ in sqls]
 
 
+@functools.lru_cache(maxsize=None)
 def get_tokenizer(tokenizer_type: str):
-    return 0
-    tokenizer = AutoTokenizer.from_pretrained(tokenizer_type, use_fast=False)
-    return tokenizer
+    """Load the tokenizer of a model once: tiktoken for OpenAI models, transformers for local
+    checkpoints or hub ids, and None when neither is available."""
+    if tokenizer_type is None:
+        return None
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(tokenizer_type)
+    except (ImportError, KeyError):
+        pass
+    # only names that look like a checkpoint, "llama2:7b" style ollama tags are not on the hub
+    if "/" in tokenizer_type or os.path.isdir(tokenizer_type):
+        try:
+            return transformers.AutoTokenizer.from_pretrained(tokenizer_type, use_fast=False)
+        except (ImportError, OSError, ValueError):
+            pass
+    return None
 
 
 def count_tokens(string: str, tokenizer_type: str=None, tokenizer=None):
-    return 0
-    # if tokenizer is None:
-    #     tokenizer = get_tokenizer(tokenizer_type)
-    #
-    # n_tokens = len(tokenizer.encode(string))
-    # return n_tokens
+    if tokenizer is None:
+        tokenizer = get_tokenizer(tokenizer_type)
+    if tokenizer is None:
+        # about four characters per token for english text and code
+        return len(string) // 4 + 1
+
+    n_tokens = len(tokenizer.encode(string))
+    return n_tokens
+
 
+# quoted text, or a run of other characters up to the next space followed by the spaces
+_SPLIT_QUOTED = re.compile(r"'[^']*'?")
+_SPLIT_WORD = re.compile(r"([^ ]*) *")
 
+
+@functools.lru_cache(maxsize=100000)
 def sql_normalization(sql):
     sql = sql.strip()
     def white_space_fix(s):
-        parsed_s = Parser(s)
-        s = " ".join([token.value for token in parsed_s.tokens])
-
-        return s
+        return " ".join(token_values(s))
 
     # convert everything except text between single quotation marks to lower case
     def lower(s):
-        in_quotation = False
-        out_s = ""
-        for char in s:
-            if in_quotation:
-                out_s += char
-            else:
-                out_s += char.lower()
-
-            if char == "'":
-                if in_quotation:
-                    in_quotation = False
-                else:
-                    in_quotation = True
-
-        return out_s
+        parts = s.split("'")
+        parts[0::2] = [part.lower() for part in parts[0::2]]
+        return "'".join(parts)
 
     # remove ";"
     def remove_semicolon(s):
@@ -227,39 +229,31 @@ def sql_normalization(sql):
         return s
 
     def sql_split(s):
-        while "  " in s:
-            s = s.replace("  ", " ")
-        s = s.strip()
+        s = re.sub(" {2,}", " ", s).strip()
         i = 0
         toks = []
         while i < len(s):
-            tok = ""
             if s[i] == "'":
-                tok = tok + s[i]
-                i += 1
-                while i < len(s) and s[i] != "'":
-                    tok = tok + s[i]
-                    i += 1
-                if i < len(s):
-                    tok = tok + s[i]
-                    i += 1
+                m = _SPLIT_QUOTED.match(s, i)
+                toks.append(m.group())
             else:
-                while i < len(s) and s[i] != " ":
-                    tok = tok + s[i]
-                    i += 1
-                while i < len(s) and s[i] == " ":
-                    i += 1
-            toks.append(tok)
+                m = _SPLIT_WORD.match(s, i)
+                toks.append(m.group(1))
+            i = m.end()
         return toks
 
     def remove_table_alias(s):
-        tables_aliases = Parser(s).tables_aliases
+        toks = sql_split(s)
+        # only the aliases t1 ... t10 and the prefixes of dotted names are replaced
+        keys = {"t{}".format(i) for i in range(1, 11)}
+        keys.update(tok.split('.')[0] for tok in toks if '.' in tok)
+        tables_aliases = tables_aliases_of(s, keys)
         new_tables_aliases = {}
         for i in range(1, 11):
             if "t{}".format(i) in tables_aliases.keys():
                 new_tables_aliases["t{}".format(i)] = tables_aliases["t{}".format(i)]
         table_names = []
-        for tok in sql_split(s):
+        for tok in toks:
             if '.' in tok:
                 table_names.append(tok.split('.')[0])
         for table_name in table_names:
@@ -269,7 +263,7 @@ def sql_normalization(sql):
 
         new_s = []
         pre_tok = ""
-        for tok in sql_split(s):
+        for tok in toks:
             if tok in tables_aliases.keys():
                 if pre_tok == 'as':
                     new_s = new_s[:-1]
@@ -310,44 +304,47 @@ def sql_normalization(sql):
     return processing_func(sql.strip())
 
 
+_skeleton_vocabularies = {}
+
+
+def get_skeleton_vocabulary(db_schema):
+    """Names masked by sql2skeleton for a Spider schema dict or a `load_tables` Schema, built once per db_id."""
+    vocabulary = getattr(db_schema, "skeleton_vocabulary", None)
+    if vocabulary is not None:
+        return vocabulary
+    db_id = db_schema["db_id"]
+    if db_id not in _skeleton_vocabularies:
+        _skeleton_vocabularies[db_id] = build_skeleton_vocabulary(db_schema)
+    return _skeleton_vocabularies[db_id]
+
+
 def sql2skeleton(sql: str, db_schema):
     sql = sql_normalization(sql)
+    vocabulary = get_skeleton_vocabulary(db_schema)
 
-    table_names_original, table_dot_column_names_original, column_names_original = [], [], []
-    column_names_original.append("*")
-    for table_id, table_name_original in enumerate(db_schema["table_names_original"]):
-        table_names_original.append(table_name_original.lower())
-        table_dot_column_names_original.append(table_name_original + ".*")
-        for column_id_and_name in db_schema["column_names_original"]:
-            column_id = column_id_and_name[0]
-            column_name_original = column_id_and_name[1]
-            table_dot_column_names_original.append(table_name_original.lower() + "." + column_name_original.lower())
-            column_names_original.append(column_name_original.lower())
-
-    parsed_sql = Parser(sql)
     new_sql_tokens = []
-    for token in parsed_sql.tokens:
+    for token in token_values(sql):
         # mask table names
-        if token.value in table_names_original:
+        if token in vocabulary.tables:
             new_sql_tokens.append("_")
         # mask column names
-        elif token.value in column_names_original \
-                or token.value in table_dot_column_names_original:
+        elif token in vocabulary.columns \
+                or token in vocabulary.table_dot_columns:
             new_sql_tokens.append("_")
         # mask string values
-        elif token.value.startswith("'") and token.value.endswith("'"):
+        elif token.startswith("'") and token.endswith("'"):
             new_sql_tokens.append("_")
         # mask positive int number
-        elif token.value.isdigit():
+        elif token.isdigit():
             new_sql_tokens.append("_")
         # mask negative int number
-        elif isNegativeInt(token.value):
+        elif isNegativeInt(token):
             new_sql_tokens.append("_")
         # mask float number
-        elif isFloat(token.value):
+        elif isFloat(token):
             new_sql_tokens.append("_")
         else:
-            new_sql_tokens.append(token.value.strip())
+            new_sql_tokens.append(token.strip())
 
     sql_skeleton = " ".join(new_sql_tokens)
 
@@ -0,0 +1,189 @@
+import os
+import pickle
+import re
+import sqlite3
+from collections import defaultdict
+
+from utils.pool import get_pool
+
+# words of a question that never identify a table, column or value
+STOPWORDS = {
+    "a", "all", "an", "and", "are", "as", "at", "by", "each", "find", "for", "from", "get", "give", "in", "is",
+    "list", "me", "of", "on", "or", "return", "select", "show", "that", "the", "their", "them", "to", "what",
+    "which", "who", "whose", "with"
+}
+# state names a question may use for the abbreviations stored in the tables
+US_STATES = {
+    "alabama": "al", "alaska": "ak", "arizona": "az", "arkansas": "ar", "california": "ca", "colorado": "co",
+    "connecticut": "ct", "delaware": "de", "florida": "fl", "georgia": "ga", "hawaii": "hi", "idaho": "id",
+    "illinois": "il", "indiana": "in", "iowa": "ia", "kansas": "ks", "kentucky": "ky", "louisiana": "la",
+    "maine": "me", "maryland": "md", "massachusetts": "ma", "michigan": "mi", "minnesota": "mn",
+    "mississippi": "ms", "missouri": "mo", "montana": "mt", "nebraska": "ne", "nevada": "nv",
+    "new hampshire": "nh", "new jersey": "nj", "new mexico": "nm", "new york": "ny", "north carolina": "nc",
+    "north dakota": "nd", "ohio": "oh", "oklahoma": "ok", "oregon": "or", "pennsylvania": "pa",
+    "rhode island": "ri", "south carolina": "sc", "south dakota": "sd", "tennessee": "tn", "texas": "tx",
+    "utah": "ut", "vermont": "vt", "virginia": "va", "washington": "wa", "west virginia": "wv",
+    "wisconsin": "wi", "wyoming": "wy"
+}
+MAX_SPAN = 4
+# shorter initials, like "wa" of "what are", are too likely to match by chance
+MIN_INITIALS = 3
+# values returned per column, the index holds all values so a common word can match hundreds
+MAX_MATCHES = 10
+
+
+def normalize(value):
+    return " ".join(re.findall(r"[a-z0-9]+", str(value).lower()))
+
+
+def trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def initials(words):
+    """Initials of the words that are not stopwords, None when there are fewer than MIN_INITIALS."""
+    letters = "".join(word[0] for word in words if word not in STOPWORDS)
+    return letters if len(letters) >= MIN_INITIALS else None
+
+
+def value_terms(norm):
+    """Index terms of a normalized cell value: the whole value, its words, initials and word trigrams."""
+    words = norm.split()
+    terms = {"v:" + norm}
+    terms.update("w:" + word for word in words if word not in STOPWORDS)
+    if initials(words):
+        terms.add("v:" + initials(words))
+    for word in words:
+        if len(word) >= 4:
+            terms.update("g:" + gram for gram in trigrams(word))
+    return terms
+
+
+def question_spans(words):
+    """Every run of up to MAX_SPAN words, the state codes of those runs and the initials of the runs without stopwords."""
+    spans, abbreviations, span_initials = set(), set(), set()
+    for i in range(len(words)):
+        for j in range(i + 1, min(i + MAX_SPAN, len(words)) + 1):
+            span = " ".join(words[i:j])
+            spans.add(span)
+            if not STOPWORDS.intersection(words[i:j]) and initials(words[i:j]):
+                span_initials.add(initials(words[i:j]))
+            if span in US_STATES:
+                abbreviations.add(US_STATES[span])
+    return spans, abbreviations, span_initials
+
+
+class ValueIndex:
+    """Inverted index from normalized cell values to the (table, column) they occur in, per database."""
+
+    def __init__(self):
+        self.values = []
+        self.postings = defaultdict(lambda: defaultdict(set))
+
+    def add(self, db_id, table, column, value):
+        if not isinstance(value, str):
+            return
+        norm = normalize(value)
+        if not norm:
+            return
+        value_id = len(self.values)
+        self.values.append((table, column, value, norm))
+        for term in value_terms(norm):
+            self.postings[db_id][term].add(value_id)
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        """Index the value samples stored in the catalog only."""
+        index = cls()
+        for db_id, table, column, value in catalog.iter_values():
+            index.add(db_id, table, column, value)
+        return index
+
+    @classmethod
+    def from_databases(cls, catalog, db_dir):
+        """Index every distinct value of the columns in the catalog, streamed from the databases under db_dir."""
+        index = cls()
+        for db_id in catalog.get_db_ids():
+            db_path = os.path.join(db_dir, db_id, f"{db_id}.sqlite")
+            with get_pool().connection(db_path=db_path) as connection:
+                for table in catalog.get_table_names(db_id):
+                    for column in catalog.get_columns(db_id, table) or []:
+                        try:
+                            for (value,) in connection.execute(f'SELECT DISTINCT "{column}" FROM "{table}"'):
+                                index.add(db_id, table, column, value)
+                        except sqlite3.Error as e:
+                            print(f"Error indexing {db_id}.{table}.{column}: {e}")
+        return index
+
+    def match(self, db_id, question, tables=None, min_score=1.0):
+        """Values of db_id that the question mentions, as {table: {column: [values]}} ordered by score.
+
+        A value scores 3 when the question contains it (or its state code), 2.5 when the initials of
+        words in the question spell it or its initials are in the question, up to 2 for the fraction
+        of its words in the question, and up to 1.5 for misspelled words by trigram overlap. Columns
+        with a value scoring 2.5 or more drop their lower scores, and keep at most MAX_MATCHES values.
+        """
+        postings = self.postings.get(db_id)
+        if not postings:
+            return {}
+        words = [word for word in normalize(question).split() if word not in STOPWORDS]
+        spans, abbreviations, span_initials = question_spans(normalize(question).split())
+        question_words = set(words)
+        if tables is not None:
+            tables = {table.lower() for table in tables}
+
+        candidates = set()
+        for span in spans | abbreviations | span_initials:
+            candidates |= postings.get("v:" + span, set())
+        for word in question_words:
+            candidates |= postings.get("w:" + word, set())
+        question_grams = {word: trigrams(word) for word in question_words if len(word) >= 4}
+        for grams in question_grams.values():
+            for gram in grams:
+                candidates |= postings.get("g:" + gram, set())
+
+        scored = []
+        for value_id in candidates:
+            table, column, value, norm = self.values[value_id]
+            if tables is not None and table.lower() not in tables:
+                continue
+            if norm in spans or norm in abbreviations:
+                score = 3.0
+            # initials only hint at a value, so a value the question states outranks them
+            elif norm in span_initials or (" " in norm and initials(norm.split()) in spans):
+                score = 2.5
+            else:
+                value_words = [word for word in norm.split() if word not in STOPWORDS] or norm.split()
+                score = 2.0 * sum(word in question_words for word in value_words) / len(value_words)
+                for word in value_words:
+                    if len(word) < 4:
+                        continue
+                    grams = trigrams(word)
+                    for question_word, q_grams in question_grams.items():
+                        similarity = len(grams & q_grams) / len(grams | q_grams)
+                        if similarity >= 0.5:
+                            score = max(score, 1.5 * similarity)
+            if score >= min_score:
+                scored.append((score, table, column, value))
+
+        matches = defaultdict(lambda: defaultdict(list))
+        best = {}
+        for score, table, column, value in sorted(scored, key=lambda item: -item[0]):
+            # partial matches are noise next to a value the question names in the same column
+            if best.setdefault((table, column), score) >= 2.5 > score:
+                continue
+            if len(matches[table][column]) < MAX_MATCHES:
+                matches[table][column].append(value)
+        return {table: dict(columns) for table, columns in matches.items()}
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            pickle.dump((self.values, {db_id: dict(terms) for db_id, terms in self.postings.items()}), file)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path, 'rb') as file:
+            index.values, postings = pickle.load(file)
+        index.postings.update(postings)
+        return index